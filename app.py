@@ -1,8 +1,26 @@
 import streamlit as st
+import base64
+import hashlib
+import io
 import os
 import tempfile
 from collections import defaultdict
 import subprocess
+import render_server
+
+# Local render service (render_server.py); previews fall back to process.sh when it is not running
+RENDER_SERVER_URL = os.environ.get('ILLUSTRATE_SERVER', render_server.DEFAULT_URL)
+
+# Previews are shown as WebP at the displayed width; the full PNG is only sent on download
+PREVIEW_WIDTH = 600
+
+# Outline, fog and shadow inputs in the order of a SWEEP style card, with their defaults
+SWEEP_DEFAULTS = {
+    'contour_low': 3.0, 'contour_high': 10.0, 'kernel': 4, 'diff_min': 0.0, 'diff_max': 5.0,
+    'subunit_low': 3.0, 'subunit_high': 10.0, 'residue_low': 3.0, 'residue_high': 8.0,
+    'residue_diff': 6000.0, 'fog_front': 1.0, 'fog_back': 1.0, 'shadow_flag': 1,
+    'shadow_contribution': 0.0023, 'shadow_angle': 2.0, 'shadow_z': 1.0, 'shadow_max': 0.2,
+}
 
 st.set_page_config(page_title="ILLUSTRATE Input File Generator", page_icon=":atom:", layout="wide")
 
@@ -230,10 +248,15 @@ def create_selection_cards(selected_chains, selected_hetatm, chain_atoms, atom_c
                     )
     return cards
 
-def create_input_file(pdb_file, selected_chains, selected_hetatm, chain_atoms, atom_colors, atom_sizes, center_type, translation, scale, x_rotation, y_rotation, z_rotation, world_params, illustration_params, output_file, chain_residues):
+def create_input_file(pdb_file, selected_chains, selected_hetatm, chain_atoms, atom_colors, atom_sizes, center_type, translation, scale, x_rotation, y_rotation, z_rotation, world_params, illustration_params, output_file, chain_residues, model=None):
     """Create the input file for ILLUSTRATE program."""
     content = []
     
+    # MODEL command (only read the selected model of an ensemble)
+    if model:
+        content.append("model")
+        content.append(f"{model},{model},0")
+    
     # READ command
     content.append("read")
     content.append(pdb_file)
@@ -294,11 +317,21 @@ def hex_to_rgb(hex_color):
     return tuple(f"{min(max(x, 0.0), 1.0):.1f}" for x in rgb)
 
 def save_uploaded_file(uploaded_file):
-    """Save the uploaded file to a temporary location and return the path."""
+    """Save the uploaded file to a temporary location and return the path.
+
+    The file is named by its content hash and written once, so reruns of
+    the app keep giving the render service the same path.
+    """
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdb') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            return tmp_file.name
+        content = uploaded_file.getvalue()
+        # illustrate reads file names of up to 80 characters
+        name = f"pdb_{hashlib.sha256(content).hexdigest()[:12]}.pdb"
+        path = os.path.join(tempfile.gettempdir(), name)
+        if not os.path.exists(path):
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdb') as tmp_file:
+                tmp_file.write(content)
+            os.replace(tmp_file.name, path)
+        return path
     except Exception as e:
         st.error(f"Error saving file: {str(e)}")
         return None
@@ -309,6 +342,11 @@ def get_atom_lines(pdb_content):
     atom_lines = [line for line in lines if line.startswith(('ATOM  ', 'HETATM'))]
     return atom_lines
 
+def get_model_count(pdb_content):
+    """Count the MODEL records in PDB content (NMR or MD ensembles)."""
+    lines = pdb_content.decode('utf-8').split('\n')
+    return sum(1 for line in lines if line.startswith('MODEL'))
+
 def get_chain_info(atom_lines):
     """Extract chain information and unique HETATM residue names for each chain."""
     chains = set()
@@ -402,8 +440,65 @@ def get_atom_color(chain, atom):
         # For other atoms, use a muted version
         return f'#{int(r*0.7):02x}{int(g*0.7):02x}{int(b*0.7):02x}'
 
+def display_path(output_png):
+    """Path of the display-sized derivative of a rendered PNG."""
+    return output_png.replace('.png', '_preview.webp')
+
+def generate_preview_with_server(input_file):
+    """Render the preview on the local render service.
+
+    Writes only the display-sized WebP and returns its path; the full PNG
+    stays in the service's cache until it is downloaded. Raises
+    ConnectionError when no service is running.
+    """
+    with open(input_file) as f:
+        input_content = f.read()
+    try:
+        preview = render_server.request_render(input_content, RENDER_SERVER_URL, timeout=30,
+                                               width=PREVIEW_WIDTH)
+    except render_server.RenderError as e:
+        st.error(f"Error generating preview: {str(e)}")
+        return None
+    output_png = input_file.replace('.inp', '.png')
+    # a PNG left by process.sh would be an older render
+    if os.path.exists(output_png):
+        os.remove(output_png)
+    with open(display_path(output_png), 'wb') as f:
+        f.write(preview)
+    return display_path(output_png)
+
+def full_resolution_image(input_content, png_file=None):
+    """Return the full-resolution PNG of a preview, for download.
+
+    Reads the PNG written by process.sh when there is one, otherwise gets
+    the render from the service, where it is usually still cached.
+    """
+    if png_file and os.path.exists(png_file):
+        with open(png_file, 'rb') as f:
+            return f.read()
+    return render_server.request_render(input_content, RENDER_SERVER_URL, timeout=30)
+
+def preview_html(preview_file, caption):
+    """Inline the WebP preview in an img tag.
+
+    st.image converts images with transparency to PNG, which is several
+    times larger than the WebP.
+    """
+    with open(preview_file, 'rb') as f:
+        data = base64.b64encode(f.read()).decode()
+    return (f'<div class="preview-image"><img src="data:image/webp;base64,{data}" '
+            f'width="{PREVIEW_WIDTH}" alt="{caption}"><p>{caption}</p></div>')
+
 def generate_preview(input_file, pdb_file):
-    """Generate a preview image using the process.sh script."""
+    """Generate a preview image using the render service or the process.sh script.
+
+    Returns the path of the display-sized WebP.
+    """
+    try:
+        return generate_preview_with_server(input_file)
+    except ConnectionError:
+        pass  # no render service running, spawn illustrate through process.sh
+
     try:
         # Check if process.sh exists
         if not os.path.exists('process.sh'):
@@ -445,7 +540,11 @@ def generate_preview(input_file, pdb_file):
                 try:
                     from PIL import Image
                     Image.open(output_png).verify()
-                    return output_png
+                    with open(output_png, 'rb') as f:
+                        preview = render_server.preview_image(f.read(), PREVIEW_WIDTH)
+                    with open(display_path(output_png), 'wb') as f:
+                        f.write(preview)
+                    return display_path(output_png)
                 except Exception as e:
                     st.error(f"Generated preview file is not a valid image: {str(e)}")
                     # Clean up invalid file
@@ -465,6 +564,101 @@ def generate_preview(input_file, pdb_file):
         st.error(f"Unexpected error during preview generation: {str(e)}")
         return None
 
+def search_orientations(input_content, illustration_params, samples=200, top=5):
+    """Run the ORIENT command on the structure of an input file.
+
+    Returns a list of (xrot, yrot, zrot, score) tuples, best first.
+    """
+    cards, _ = compiled_structure(input_content)
+    content = cards + ["illustrate"] + list(illustration_params)
+    content += ["orient", f"{samples},128,{top}", "1.0,1.0,1.0,1.0"]
+    result = subprocess.run(
+        ['./illustrate'],
+        input="\n".join(content) + "\n",
+        capture_output=True,
+        text=True,
+        timeout=60
+    )
+    views = []
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) >= 6 and fields[0] == 'orientation' and fields[1].isdigit():
+            views.append(tuple(float(x) for x in fields[2:6]))
+    if not views:
+        raise RuntimeError(result.stderr.strip() or "no orientations found")
+    return views
+
+def compiled_structure(input_content):
+    """Return the cards that give illustrate the structure of an input file.
+
+    Loads the compiled binary structure when it is current, otherwise reads
+    the PDB file and compiles it for the next time. Returns the cards and
+    the path of the structure file.
+    """
+    read_block, pdb_paths, _ = render_server.split_input(input_content)
+    key = render_server.structure_key(read_block, {p: render_server.file_digest(p) for p in pdb_paths})
+    return render_server.structure_block(read_block, key)
+
+def structure_summary(path):
+    """Describe a compiled structure file, or return None if it does not exist yet."""
+    try:
+        structure = render_server.load_structure(path)
+    except (OSError, render_server.RenderError):
+        return None
+    copies = max(structure['nbiomat'], structure['ninst'], 1)
+    return f"{len(structure['coord'])} atoms, {structure['nsu']} subunits, {copies} copies"
+
+def apply_orientation(x_rotation, y_rotation, z_rotation):
+    """Copy a suggested view into the rotation inputs."""
+    st.session_state.x_rotation = x_rotation
+    st.session_state.y_rotation = y_rotation
+    st.session_state.z_rotation = z_rotation
+
+def sweep_styles(base, variations, limit=64):
+    """Return every combination of the varied parameters, on top of the base style."""
+    styles = [dict(base)]
+    for key, values in variations.items():
+        styles = [dict(style, **{key: value}) for style in styles for value in values]
+    return styles[:limit]
+
+def run_sweep(input_content, styles, columns=4, shrink=4):
+    """Render every style on one rasterization with the SWEEP command.
+
+    Returns the contact sheet as PNG bytes. The full-size images of the
+    styles are removed with the working directory.
+    """
+    cards, _ = compiled_structure(input_content)
+    _, _, render_lines = render_server.split_input(input_content)
+    view = []
+    for line in render_lines:
+        if line[:3].lower() == 'cal':
+            break
+        view.append(line)
+    content = cards + view + ["sweep", f"{len(styles)},{columns},{shrink}"]
+    content += [",".join(str(style[key]) for key in SWEEP_DEFAULTS) for style in styles]
+    content += ["calculate", "sweep.pnm"]
+    with tempfile.TemporaryDirectory(prefix='sweep_') as workdir:
+        result = subprocess.run(
+            [os.path.abspath('./illustrate')],
+            input="\n".join(content) + "\n",
+            cwd=workdir,
+            capture_output=True,
+            text=True,
+            timeout=300
+        )
+        sheet = os.path.join(workdir, 'sweep_sheet.pnm')
+        if not os.path.exists(sheet):
+            raise RuntimeError(result.stderr.strip() or "no contact sheet written")
+        from PIL import Image
+        sheet_png = io.BytesIO()
+        Image.open(sheet).save(sheet_png, format='PNG')
+    return sheet_png.getvalue()
+
+def apply_style(style):
+    """Copy a style of the sweep into the outline, fog and shadow inputs."""
+    for key, value in style.items():
+        st.session_state[key] = value
+
 def get_chain_residues(atom_lines, selected_chains):
     """Get residues for each selected chain from ATOM and HETATM lines."""
     chain_residues = defaultdict(set)
@@ -489,10 +683,24 @@ def main():
     # Initialize session state variables if they don't exist
     if 'preview_image' not in st.session_state:
         st.session_state.preview_image = None
+    if 'preview_input' not in st.session_state:
+        st.session_state.preview_input = None
+    if 'full_image' not in st.session_state:
+        st.session_state.full_image = None
     if 'pdb_file' not in st.session_state:
         st.session_state.pdb_file = None
     if 'output_file' not in st.session_state:
         st.session_state.output_file = None
+    if 'orientations' not in st.session_state:
+        st.session_state.orientations = []
+    for key, value in (('x_rotation', 0.0), ('y_rotation', 0.0), ('z_rotation', 90.0)):
+        if key not in st.session_state:
+            st.session_state[key] = value
+    for key, value in SWEEP_DEFAULTS.items():
+        if key not in st.session_state:
+            st.session_state[key] = value
+    if 'sweep' not in st.session_state:
+        st.session_state.sweep = None
 
     # Initialize variables to prevent UnboundLocalError
     chain_atoms = {}
@@ -500,6 +708,7 @@ def main():
     selected_chains = []
     selected_hetatm = set()
     atom_lines = []
+    model_number = None
     
     # Create two main columns for form and preview
     form_col, preview_col = st.columns([6, 4])
@@ -538,6 +747,19 @@ def main():
                         )
                     else:
                         st.warning("No ATOM or HETATM lines found in the file")
+                
+                model_count = get_model_count(uploaded_file.getvalue())
+                if model_count > 1:
+                    with st.expander("Model Selection", expanded=True):
+                        model_number = st.number_input(
+                            f"Model (1-{model_count})",
+                            min_value=1,
+                            max_value=model_count,
+                            value=1,
+                            step=1,
+                            key="model_number",
+                            help="Only the selected model of the ensemble is read and drawn"
+                        )
             
             with st.expander("Chain Selection", expanded=True):
                 atom_descriptors = []
@@ -586,7 +808,8 @@ def main():
                         st.session_state.pdb_file, selected_chains, selected_hetatm, chain_atoms,
                         st.session_state, st.session_state,  # For atom_colors and atom_sizes
                         center_type, translation, scale, x_rotation, y_rotation, z_rotation,
-                        world_params, illustration_params, st.session_state.output_file, chain_residues
+                        world_params, illustration_params, st.session_state.output_file, chain_residues,
+                        model=model_number
                     )
                     
                     # Save the input file
@@ -744,9 +967,9 @@ def main():
                 with col1:
                     scale = st.number_input("Scale Factor", value=12.0, step=1.0)
                 with col2:
-                    x_rotation = st.number_input("X Rotation (degrees)", value=0.0, step=1.0)
-                    y_rotation = st.number_input("Y Rotation (degrees)", value=0.0, step=1.0)
-                    z_rotation = st.number_input("Z Rotation (degrees)", value=90.0, step=1.0)
+                    x_rotation = st.number_input("X Rotation (degrees)", step=1.0, key="x_rotation")
+                    y_rotation = st.number_input("Y Rotation (degrees)", step=1.0, key="y_rotation")
+                    z_rotation = st.number_input("Z Rotation (degrees)", step=1.0, key="z_rotation")
             
             with st.expander("World Parameters", expanded=False):
                 col1, col2 = st.columns(2)
@@ -763,8 +986,8 @@ def main():
                 
                 with col2:
                     st.write("Fog Settings")
-                    fog_front = st.number_input("Front Fog Opacity", value=1.0)
-                    fog_back = st.number_input("Back Fog Opacity", value=1.0)
+                    fog_front = st.number_input("Front Fog Opacity", key="fog_front")
+                    fog_back = st.number_input("Back Fog Opacity", key="fog_back")
                     
                     st.write("Image Size")
                     size_x = st.number_input("Size X", value=-30)
@@ -773,35 +996,35 @@ def main():
             with st.expander("Shadow Parameters", expanded=False):
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    shadow_flag = st.number_input("Shadow Flag", value=1)
+                    shadow_flag = st.number_input("Shadow Flag", key="shadow_flag")
                 with col2:
-                    shadow_contribution = st.number_input("Shadow Contribution", value=0.0023)
+                    shadow_contribution = st.number_input("Shadow Contribution", key="shadow_contribution")
                 with col3:
-                    shadow_angle = st.number_input("Shadow Angle", value=2.0)
+                    shadow_angle = st.number_input("Shadow Angle", key="shadow_angle")
                 
                 col1, col2 = st.columns(2)
                 with col1:
-                    shadow_z = st.number_input("Shadow Z", value=1.0)
+                    shadow_z = st.number_input("Shadow Z", key="shadow_z")
                 with col2:
-                    shadow_max = st.number_input("Shadow Max", value=0.2)
+                    shadow_max = st.number_input("Shadow Max", key="shadow_max")
             
             with st.expander("Illustration Parameters", expanded=False):
                 col1, col2 = st.columns(2)
                 with col1:
                     st.write("Contour Outlines")
-                    contour_low = st.number_input("Contour Low", value=3.0)
-                    contour_high = st.number_input("Contour High", value=10.0)
-                    kernel = st.number_input("Kernel", value=4)
-                    diff_min = st.number_input("Diff Min", value=0.0)
-                    diff_max = st.number_input("Diff Max", value=5.0)
+                    contour_low = st.number_input("Contour Low", key="contour_low")
+                    contour_high = st.number_input("Contour High", key="contour_high")
+                    kernel = st.number_input("Kernel", key="kernel")
+                    diff_min = st.number_input("Diff Min", key="diff_min")
+                    diff_max = st.number_input("Diff Max", key="diff_max")
                 
                 with col2:
                     st.write("Subunit & Residue Outlines")
-                    subunit_low = st.number_input("Subunit Low", value=3.0)
-                    subunit_high = st.number_input("Subunit High", value=10.0)
-                    residue_low = st.number_input("Residue Low", value=3.0)
-                    residue_high = st.number_input("Residue High", value=8.0)
-                    residue_diff = st.number_input("Residue Diff", value=6000.0)
+                    subunit_low = st.number_input("Subunit Low", key="subunit_low")
+                    subunit_high = st.number_input("Subunit High", key="subunit_high")
+                    residue_low = st.number_input("Residue Low", key="residue_low")
+                    residue_high = st.number_input("Residue High", key="residue_high")
+                    residue_diff = st.number_input("Residue Diff", key="residue_diff")
             
             world_params = [bg_r, bg_g, bg_b, fog_r, fog_g, fog_b, fog_front, fog_back,
                           shadow_flag, shadow_contribution, shadow_angle, shadow_z, shadow_max,
@@ -812,6 +1035,64 @@ def main():
                 f"{subunit_low},{subunit_high}",
                 f"{residue_low},{residue_high},{residue_diff}"
             ]
+            
+            with st.expander("Suggested Views", expanded=False):
+                st.write("Scores views from all around the molecule on low-resolution renders")
+                if st.button("Find Views"):
+                    # Uses the input generated on the previous run, the rotation cards are ignored
+                    input_content = st.session_state.get('input_content')
+                    if not input_content:
+                        st.warning("Please upload a PDB file first")
+                    else:
+                        try:
+                            with st.spinner("Searching orientations..."):
+                                st.session_state.orientations = search_orientations(input_content, illustration_params)
+                            st.session_state.structure_summary = structure_summary(compiled_structure(input_content)[1])
+                        except (render_server.RenderError, RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+                            st.error(f"Orientation search failed: {str(e)}")
+                if st.session_state.get('structure_summary'):
+                    st.caption(st.session_state.structure_summary)
+                for i, (x_rot, y_rot, z_rot, score) in enumerate(st.session_state.orientations):
+                    col1, col2 = st.columns([3, 1])
+                    with col1:
+                        st.write(f"{i + 1}. X {x_rot:.1f}°, Y {y_rot:.1f}°, Z {z_rot:.1f}° (score {score:.2f})")
+                    with col2:
+                        st.button("Use", key=f"use_orientation_{i}", on_click=apply_orientation, args=(x_rot, y_rot, z_rot))
+
+            with st.expander("Style Sweep", expanded=False):
+                st.write("Draws the current view once and shades it with every combination of the values below")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    diff_values = st.text_input("Diff Max values", "2.0,5.0,20.0")
+                with col2:
+                    fog_values = st.text_input("Back Fog Opacity values", "1.0,0.5")
+                with col3:
+                    shadow_values = st.text_input("Shadow Flag values", "1,0")
+                if st.button("Render Sweep"):
+                    input_content = st.session_state.get('input_content')
+                    if not input_content:
+                        st.warning("Please upload a PDB file first")
+                    else:
+                        try:
+                            variations = {
+                                'diff_max': [float(v) for v in diff_values.split(',') if v.strip()],
+                                'fog_back': [float(v) for v in fog_values.split(',') if v.strip()],
+                                'shadow_flag': [int(v) for v in shadow_values.split(',') if v.strip()],
+                            }
+                            styles = sweep_styles({key: st.session_state[key] for key in SWEEP_DEFAULTS}, variations)
+                            with st.spinner(f"Rendering {len(styles)} styles..."):
+                                st.session_state.sweep = (run_sweep(input_content, styles), styles)
+                        except (ValueError, render_server.RenderError, RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+                            st.error(f"Style sweep failed: {str(e)}")
+                if st.session_state.sweep:
+                    sheet_png, styles = st.session_state.sweep
+                    st.image(sheet_png, caption="Styles, numbered in order")
+                    for i, style in enumerate(styles):
+                        col1, col2 = st.columns([3, 1])
+                        with col1:
+                            st.write(f"{i + 1}. Diff Max {style['diff_max']}, Back Fog {style['fog_back']}, Shadows {style['shadow_flag']}")
+                        with col2:
+                            st.button("Use", key=f"use_style_{i}", on_click=apply_style, args=(style,))
         
     # Add the new tab content for showing generated input
     with tab4:
@@ -827,8 +1108,10 @@ def main():
                     st.session_state.pdb_file, selected_chains, selected_hetatm, chain_atoms,
                     st.session_state, st.session_state,  # For atom_colors and atom_sizes
                     center_type, translation, scale, x_rotation, y_rotation, z_rotation,
-                    world_params, illustration_params, st.session_state.output_file, chain_residues
+                    world_params, illustration_params, st.session_state.output_file, chain_residues,
+                    model=model_number
                 )
+                st.session_state.input_content = input_content
                 
                 # Display the generated input file in a text area
                 st.text_area(
@@ -882,6 +1165,29 @@ def main():
                 max-width: 100% !important;
                 text-align: center !important;
             }
+            div.preview-image {
+                display: flex;
+                flex-direction: column;
+                justify-content: center;
+                align-items: center;
+                background-color: #f0f2f6;
+                border-radius: 5px;
+                padding: 20px;
+                margin: 100px 100px;
+            }
+            div.preview-image img {
+                width: 400px !important;
+                max-width: 100% !important;
+                height: auto !important;
+            }
+            div.preview-image p {
+                width: 400px;
+                max-width: 100%;
+                text-align: center;
+                font-size: 14px;
+                color: rgba(49, 51, 63, 0.6);
+                margin: 8px 0 0 0;
+            }
             div[data-testid="stButton"] {
                 display: flex;
                 justify-content: center;
@@ -893,9 +1199,25 @@ def main():
         
         # Show either the generated preview or a placeholder
         if st.session_state.preview_image and os.path.exists(st.session_state.preview_image):
-            st.image(st.session_state.preview_image, 
-                    caption="Molecular Structure Preview",
-                    width=600)
+            st.markdown(preview_html(st.session_state.preview_image, "Molecular Structure Preview"),
+                        unsafe_allow_html=True)
+            # the full-resolution PNG is only fetched when it is asked for
+            full_png = st.session_state.preview_image.replace('_preview.webp', '.png')
+            if st.session_state.full_image is None:
+                if st.button("Full Resolution Image", key="full_image_button"):
+                    try:
+                        with st.spinner("Fetching full-resolution image..."):
+                            st.session_state.full_image = full_resolution_image(
+                                st.session_state.preview_input, full_png)
+                    except (render_server.RenderError, ConnectionError, OSError) as e:
+                        st.error(f"Could not get the full-resolution image: {str(e)}")
+            if st.session_state.full_image is not None:
+                st.download_button(
+                    label="Download Image",
+                    data=st.session_state.full_image,
+                    file_name=os.path.basename(full_png),
+                    mime="image/png"
+                )
         elif not st.session_state.preview_image:
             st.info("Upload a PDB file and click Preview to generate the molecular structure visualization")
         
@@ -911,9 +1233,11 @@ def main():
                 # Generate preview
                 with st.spinner("Generating preview..."):
                     preview_image = generate_preview(input_file_path, st.session_state.pdb_file)
+                    st.session_state.full_image = None
                     if preview_image:
                         # Force a rerun to update the image
                         st.session_state.preview_image = preview_image
+                        st.session_state.preview_input = input_content
                         # st.experimental_rerun()  # REMOVE or comment out this line
                     else:
                         st.session_state.preview_image = None
@@ -921,6 +1245,7 @@ def main():
             except Exception as e:
                 st.error(f"An unexpected error occurred: {str(e)}")
                 st.session_state.preview_image = None
+                st.session_state.full_image = None
         st.markdown('</div>', unsafe_allow_html=True)
 
 if __name__ == "__main__":
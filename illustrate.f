@@ -96,20 +96,30 @@ c ***** ATOMIC INFORMATION *****
 c ***** transformation matrices *****
 	real*4 matrixin(4,4),rm(4,4)
 c ***** biological unit stuff *****
-	real*4 biomat(4,4,500)
+	parameter (maxcopy=5000)
+	real*4 biomat(4,4,maxcopy)
 	integer*4 nbiochain,nbiomat
+c ***** scenes: molecules, instances, and the atoms drawn by each copy *****
+	parameter (maxmol=100)
+	integer*4 molfirst(maxmol),mollast(maxmol),nmol,imolecule,ndes0
+	integer*4 imol(maxcopy),ninst,icopy1(maxcopy),icopy2(maxcopy)
+	real*4 trans(3)
+c ***** anti-aliasing: outline opacity and shadow kept for edge pixels *****
+	real*4 opix(-10:3008,-10:3008),spix(-10:3008,-10:3008)
+	real*4 aasum(4),cand(4,9)
+	integer*4 naa,icand(2,9)
 	character biochain(500)
 c ***** STUFF FOR OUTLINES *****
 	real*4 l_opacity,l_opacity_ave,g_opacity,opacity
-	real*4 l(-1:1,-1:1),g
+	real*4 l(-1:1,-1:1),g,lrow(-1:1,-1:1,3000)
 	real*4 l_low,l_high,g_low,g_high
-	real*4 l_diff_min, l_diff_max
+	real*4 l_diff_min, l_diff_max, l_dmin, l_dmax
 c ***** Conical shadows *****
 	real*4 rtable(-51:51,-51:51),coneangle,pcone,rcone
 c ***** ETC. *****
 	real*4 x,y,z,rx,ry,rz,xp,yp,zp,d
 	real*4 xn,yn,zn,ci,xs,xy,xz,cs
-	character*3 comcode(10),command
+	character*3 comcode(21),command
 	character*80 filename,inputfile
 	integer*4 ixsize,iysize, idepth
 	integer*4 ix,iy,iz
@@ -119,15 +129,68 @@ c ***** stuff for reading atoms
 	character*6 atomdescriptor(1000)
 	character*10 descriptor(1000)
 	character*80 instring
+c ***** binary structure files (SAVE and LOAD) *****
+	character*4 magic
+	integer*4 nbsave,iversion
+c ***** style sweep and contact sheet (SWEEP) *****
+	parameter (maxsweep=64,maxsheet=2000)
+	real*4 swpar(17,maxsweep),swsave(17),sheet(maxsheet,maxsheet,3)
+	integer*4 nsweep,ncolumn,idown,isweep,ntx,nty,msx,msy
+	character*80 swfile
+c ***** extra output sizes (MULTISCALE) *****
+	real*4 multiscale(20),radscale(1000)
+	character*80 multifile(20),opafile
+	integer*4 nmulti,imulti,ixsizein,iysizein
+c ***** transformed coordinates, kept when several sizes are drawn *****
+	parameter (maxtrans=2000000)
+	real*4 tcoord(3,maxtrans)
+	integer*4 ntrans,itrans
+c ***** model selection and frames *****
+	integer*4 mfirst,mlast,iframe,nmodel,imodelon,ieof,inext,kframe
+	real*4 fbound(6)
+	character*80 outfile
+	character*5 frametag
+c ***** level of detail: residue and chain spheres *****
+	parameter (maxlod=700000)
+	real*4 lodcoord(3,maxlod),lodrad(maxlod),lodbnd(maxlod)
+	integer*4 lodatom(maxlod),nlodres,nlodsu,lodlevel
+	integer*4 lodfirst(maxlod),lodlast(maxlod),lodsub(maxlod)
+	real*4 bound(6)
+c ***** frustum culling: runs of atoms of one copy that reach the image *****
+	parameter (maxseg=1000000)
+	integer*4 iseg(3,maxseg),nseg,icull
+	real*4 tview(3)
+c ***** orientation search *****
+	parameter (maxori=2000)
+	real*4 oangle(2,maxori),oscore(4,maxori),worient(4),cen(3)
+	integer*4 ligtype(1000)
+c --- keep the large arrays off the stack, also when compiled with -fopenmp
+	save
 c--------------------------------------------------------------------
 c ***** Initialize a few things *****
 c--------------------------------------------------------------------
-	rscale=1.
+	data comcode/'rea','tra','xro','yro','zro','sca','cen',
+     &		             'wor','cal','ill','mul','res','mod','lod',
+     &		             'ori','mol','ins','ant','sav','loa','swe'/
 
-	illustrationflag=0
+	su(0)=9999
+	res(0)=9999
+	mfirst=1
+	mlast=999999
+	iframe=0
+	do i=1,3
+	do j=1,4
+	do k=1,maxcopy
+	biomat(i,j,k)=0.
+	if (i.eq.j) biomat(i,j,k)=1.
+	enddo
+	enddo
+	enddo
+c --- view and rendering state, also restored by the RESET command
+ 14	rscale=1.
 
-	data comcode/'rea','tra','xro','yro','zro','sca','cen',
-     &		             'wor','cal','ill'/
+	illustrationflag=0
+	autocenter=0
 
 	call clearmatrix(rm)
 	l_low=1.
@@ -136,8 +199,6 @@ c--------------------------------------------------------------------
 	g_high=21000.
 	xshmax=4000
 	yshmax=4000
-	su(0)=9999
-	res(0)=9999
 	xtran=0.
 	ytran=0.
 	ztran=0.
@@ -145,21 +206,42 @@ c--------------------------------------------------------------------
 	l_diff_min=1.
 	ixsize=0
 	iysize=0
+	nmulti=0
+	plodres=0.
+	plodsu=0.
+	naa=1
+	aadiff=0.1
+	nsweep=0
+c --- centering from the last CALCULATE, and the remaining WORLD and
+c --- ILLUSTRATION parameters, as in a new run after READ
+	xtranc=0.
+	ytranc=0.
+	ztranc=0.
 	do i=1,3
-	do j=1,4
-	do k=1,500
-	biomat(i,j,k)=0.
-	if (i.eq.j) biomat(i,j,k)=1.
-	enddo
-	enddo
+	rback(i)=0.
+	rfog(i)=0.
+	colortype(0,i)=.5
 	enddo
+	pfogh=0.
+	pfogl=0.
+	pfogdiff=0.
+	icone=0
+	pcone=0.
+	coneangle=0.
+	rcone=0.
+	pshadowmax=0.
+	ikernel=0
+	r_low=0.
+	r_high=0.
+	resdiff=0.
 c ********************* READ CONTROL CARDS ***************************
  10	read (5,101,end=999) command
 	icommand=10
-	do icount=1,10
+	do icount=1,21
  100	if (command.eq.comcode(icount)) icommand=icount
 	enddo
-  	goto (1,2,3,4,5,6,7,8,111,12),icommand
+  	goto (1,2,3,4,5,6,7,8,111,12,13,14,15,16,17,18,19,20,22,23,24),
+     &       icommand
 	write (6,102) ' ***** invalid control card read: ',
      &       command, ' ***** '
 	goto 10
@@ -168,8 +250,8 @@ c ********************* READ CONTROL CARDS ***************************
 c--------------------------------------------------------------------
 c  *** read and classify atoms ***
 c
- 1	continue
-	read(5,113) inputfile
+ 1	imolecule=0
+ 7001	read(5,113) inputfile
 	open(1,file=inputfile,form='formatted',status='old')
 c --- read atom descriptors ---
 c param: atom descriptor cards
@@ -183,6 +265,8 @@ c                                     ^^^ radius (Angstrom)
 c cards are read in order, and if there is a match, the atom is assigned that type
 c cards are read until one is found without "ATOM  " or "HETATM"
 c
+c --- a MOLECULE adds its atom types after those already read
+	if (imolecule.eq.0) then
 	ndes=0
 c --- default 50% gray ---
 	do i=0,1000
@@ -190,8 +274,15 @@ c --- default 50% gray ---
 	colortype(i,j)=.5
 	enddo
 	enddo
+	endif
+	ndes0=ndes
  7020	read(5,7100) instring
  	if (instring(1:3).eq.'END') goto 7030
+	if (ndes.ge.1000) then
+	  write(6,*) 'too many atom descriptors, card ignored: ',
+     &      instring(1:16)
+	  goto 7020
+	endif
  	  ndes=ndes+1
  	  read(instring,21) atomdescriptor(ndes),descriptor(ndes)
  	  read(instring(18:80),*) (resrange(i,ndes),i=1,2),
@@ -201,22 +292,46 @@ c --- default 50% gray ---
 	  colortype(ndes,3)=rb
 	  radtype(ndes)=rad
 	goto 7020
- 7030	write(6,*) ' atom descriptors: ',ndes
-	do i=1,ndes
+ 7030	write(6,*) ' atom descriptors: ',ndes-ndes0
+	do i=ndes0+1,ndes
 	write(6,*) "type, color, radius ",i,(colortype(i,j),j=1,3),
      &     radtype(i)
 	enddo
  21	format(a6,a10)
 c --- read atoms and classify ---
+	if (imolecule.eq.0) then
 	n=0
 	nsu=0
-	chain=" "
 	nbiomat=0
+	nmol=0
+	ninst=0
+	else
+c --- a new molecule always starts a new subunit
+	chainlast=char(0)
+	endif
+	nmol=nmol+1
+	molfirst(nmol)=n+1
+	chain=" "
 	nbiochain=0
+	nmodel=0
+	imodelon=0
+	if (mfirst.le.1) imodelon=1
+	ieof=0
+	inext=0
  7040	read(1,7100,end=7009) instring
-	if (instring(1:5).eq."MODEL") nsu=nsu+1
+	if (instring(1:5).eq."MODEL") then
+	  nsu=nsu+1
+	  nmodel=nmodel+1
+	  imodelon=0
+	  if ((nmodel.ge.mfirst).and.(nmodel.le.mlast)) imodelon=1
+	  if (nmodel.gt.mlast) goto 7009
+	endif
+c --- in frame mode, stop at the end of each selected model
+	if ((instring(1:6).eq."ENDMDL").and.(iframe.ne.0).and.
+     &      (imodelon.ne.0)) goto 7010
 
-	if (instring(12:25).eq."BIOMOLECULE: 1") then
+	if ((instring(12:25).eq."BIOMOLECULE: 1").and.
+     &      (imolecule.eq.0)) then
  8010	  read(1,7100) instring
 	  if ((instring(1:10).eq."REMARK 350").and.
      &        (instring(35:40).eq."CHAINS")) then
@@ -266,9 +381,11 @@ c --- end of BIOMAT
 
 	if ((instring(1:4).ne.'ATOM').and.
      &      (instring(1:6).ne.'HETATM')) goto 7040
+c --- skip atoms in models that were not selected
+	if (imodelon.eq.0) goto 7040
 
      	read(instring,200) ires
-	do ides=1,ndes
+	do ides=ndes0+1,ndes
 
  	if (instring(1:6).ne.atomdescriptor(ides)(1:6)) goto 7050
 
@@ -335,12 +452,42 @@ cendif
 	enddo
 	goto 7040
 c --- done reading atoms ---         
- 7009	write(6,*)' atoms read: ', n, ' from: ',inputfile
+ 7009	ieof=1
+	close(1)
+ 7010	mollast(nmol)=n
+	write(6,*)' atoms read: ', n-molfirst(nmol)+1,' from: ',inputfile
 	write(6,*) " number of subunits: ",nsu
+	if (nmodel.gt.0) write(6,*) " MODEL records seen: ",nmodel
 	write(6,*)' '
+c --- residue and chain spheres, used for level of detail, fast bounds
+c --- and the orientation search
+ 7015	call coarsen(n,coord,type,res,su,radtype,1,
+     &               lodcoord,lodrad,lodbnd,lodatom,
+     &               lodfirst,lodlast,nlodres)
+	call coarsen(n,coord,type,res,su,radtype,2,
+     &               lodcoord(1,nlodres+1),lodrad(nlodres+1),
+     &               lodbnd(nlodres+1),lodatom(nlodres+1),
+     &               lodfirst(nlodres+1),lodlast(nlodres+1),nlodsu)
+	write(6,*) 'coarse spheres: ',nlodres,' residues, ',
+     &    nlodsu,' chains'
+c --- first residue sphere of each chain sphere
+	kr=1
+	do kc=nlodres+1,nlodres+nlodsu
+ 7016	if (lodlast(kr).lt.lodfirst(kc)) then
+	  kr=kr+1
+	  goto 7016
+	endif
+	lodsub(kc)=kr
+	enddo
  7100	format(a80)
  200	format(22x,i4)
  300	format(30x,3f8.3)
+c --- back to CALCULATE when reading the next MODEL frame
+	if (inext.ne.0) then
+	  inext=0
+	  if (n.gt.0) goto 116
+	  goto 117
+	endif
 	goto 10
 c--------------------------------------------------------------------
 c       TRANSLATION 
@@ -354,40 +501,21 @@ c       TRANSLATION
 	goto 10
 c--------------------------------------------------------------------
 c	Z ROTATION
- 5	call clearmatrix(matrixin)
-	read(5,*) angle
+ 5	read(5,*) angle
 	write(6,*) 'z rotation : ',angle
-c --minus sign is because original rotations were left-handed! (warning: postdoc code)
-	angle=-angle*3.141592/180.
-	matrixin(1,1)=cos(angle)
-	matrixin(1,2)=-sin(angle)
-	matrixin(2,1)=sin(angle)
-	matrixin(2,2)=cos(angle)
-	call catenate(rm,matrixin)
+	call rotcard(rm,3,angle)
 	goto 10
 c--------------------------------------------------------------------
 c	Y ROTATION
- 4	call clearmatrix(matrixin)
-	read(5,*) angle
+ 4	read(5,*) angle
 	write(6,*) 'y rotation : ',angle
-	angle=-angle*3.141592/180.
-	matrixin(1,1)=cos(angle)
-	matrixin(1,3)=sin(angle)
-	matrixin(3,1)=-sin(angle)
-	matrixin(3,3)=cos(angle)
-	call catenate(rm,matrixin)
+	call rotcard(rm,2,angle)
 	goto 10
 c--------------------------------------------------------------------
 c	X ROTATION
- 3	call clearmatrix(matrixin)
-	read(5,*) angle
+ 3	read(5,*) angle
 	write(6,*) 'x rotation : ',angle
-	angle=-angle*3.141592/180.
-	matrixin(2,2)=cos(angle)
-	matrixin(2,3)=-sin(angle)
-	matrixin(3,2)=sin(angle)
-	matrixin(3,3)=cos(angle)
-	call catenate(rm,matrixin)
+	call rotcard(rm,1,angle)
 	goto 10
 c--------------------------------------------------------------------
 c       SCALE 
@@ -491,10 +619,373 @@ c param: resdiff -- residue outlines drawn for atoms with this difference in res
 	write(6,*) 'l parameters: ',l_low,l_high
 	write(6,*) 'g parameters: ',g_low,g_high
 	goto 10
+c--------------------------------------------------------------------
+c       MULTISCALE output: extra images written by the CALCULATE command,
+c       each at a multiple of the current scale.  Atoms are read, classified,
+c       transformed and bounded once, then each size is rasterized in turn.
+c param: nmulti -- number of extra outputs (up to 20, cards after
+c        the 20th are read and ignored)
+c param: one card per output, scale factor and filename
+c        0.25,2hhb_thumb.pnm
+c        a card without a positive scale before the comma is ignored
+c        opacity is written to the filename with "_opacity" added
+c        fixed image sizes are scaled by the same factor, autosizing padding
+c        stays in pixels, as in a separate run at that scale
+ 13	continue
+	read(5,*) ncards
+	nmulti=0
+	do i=1,ncards
+	 read(5,113) instring
+	 ic=index(instring,',')
+	 if (nmulti.ge.20) then
+	   write(6,*) 'too many extra outputs, card ignored: ',
+     &       instring(1:len_trim(instring))
+	 else if (ic.le.1) then
+	   write(6,*) 'extra output needs scale,filename, ignored: ',
+     &       instring(1:len_trim(instring))
+	 else
+	   read(instring(1:ic-1),*,err=7090) rmulti
+	   if (rmulti.le.0.) goto 7090
+	   nmulti=nmulti+1
+	   multiscale(nmulti)=rmulti
+	   multifile(nmulti)=adjustl(instring(ic+1:80))
+	   write(6,*) 'extra output: ',multiscale(nmulti),' ',
+     &       multifile(nmulti)(1:len_trim(multifile(nmulti)))
+	   goto 7091
+ 7090	   write(6,*) 'extra output needs a positive scale, ',
+     &       'ignored: ',instring(1:len_trim(instring))
+ 7091	   continue
+	 endif
+	enddo
+	goto 10
+c--------------------------------------------------------------------
+c	MODEL selection for NMR and MD ensembles, issued before READ
+c       (without it, all models are read and drawn together)
+c param: mfirst,mlast -- range of models to read, counting MODEL records from 1
+c param: iframe -- 0 = draw the selected models together
+c                  1 = draw each model as its own frame, reading one model
+c                      at a time: 2hhb.pnm is written as 2hhb_0001.pnm, ...
+c                      all frames use the centering and size of the first
+ 15	continue
+	read(5,*) mfirst,mlast,iframe
+	write(6,*) 'models: ',mfirst,' to ',mlast,' frames: ',iframe
+	goto 10
+c--------------------------------------------------------------------
+c	LEVEL OF DETAIL for large scenes at low scale
+c       when atoms are smaller than a few pixels, each residue or each
+c       chain is drawn as a single sphere with the volume of its atoms,
+c       colored by its most common atom type.  Residue and subunit
+c       outlines are kept, since every sphere carries the residue and
+c       subunit of one of its atoms.  The spheres are built once after
+c       READ and reused by every CALCULATE and output size.
+c param: plodres -- residue spheres are used when the largest atom
+c                   radius is below this many pixels (0. = never)
+c param: plodsu -- chain spheres are used below this many pixels (0. = never)
+ 16	continue
+	read(5,*) plodres,plodsu
+	write(6,*) 'level of detail, pixels: ',plodres,plodsu
+	goto 10
+c--------------------------------------------------------------------
+c	ORIENTATION search, issued after READ (and ILLUSTRATE, if used)
+c       Views from all around the molecule are drawn as small depth
+c       buffers of residue spheres, scored, and the best are written as
+c       settings for xrot, yrot and zrot cards, given in that order.
+c       With gfortran -fopenmp the views are drawn in parallel.
+c param: nsample -- number of views, spread evenly around the molecule (up to 2000)
+c param: npix -- size of the depth buffers in pixels (up to 256)
+c param: ntop -- number of settings written
+c param: worient(4) -- weights of the four scores, each from 0. to 1.:
+c                      fraction of the buffer covered by the molecule,
+c                      fraction of subunits that are visible,
+c                      fraction of covered pixels on an outline (depth steps
+c                      larger than l_diff_max, or subunit edges),
+c                      fraction of HETATM residues that are visible
+ 17	continue
+	read(5,*) nsample,npix,ntop
+	read(5,*) (worient(i),i=1,4)
+	nsample=min(nsample,maxori)
+	npix=min(npix,256)
+	ntop=min(ntop,nsample)
+	call copies(n,nbiomat,ninst,imol,molfirst,mollast,icopy1,icopy2)
+	if (nlodres.eq.0) then
+	  write(6,*) 'no atoms read for orientation search'
+	  goto 10
+	endif
+	do i=1,ndes
+	ligtype(i)=0
+	if (atomdescriptor(i).eq.'HETATM') ligtype(i)=1
+	enddo
+c --- views are scaled so the molecule fits the buffer in any orientation
+	call clearmatrix(matrixin)
+	do i=1,3
+	cen(i)=0.
+	enddo
+	ncen=0
+	do il=1,nlodres
+	do ibio=1,nbiomat
+	if ((lodfirst(il).ge.icopy1(ibio)).and.
+     &      (lodfirst(il).le.icopy2(ibio))) then
+	call xform(lodcoord(1,il),biomat(1,1,ibio),matrixin,rx,ry,rz)
+	cen(1)=cen(1)+rx
+	cen(2)=cen(2)+ry
+	cen(3)=cen(3)+rz
+	ncen=ncen+1
+	endif
+	enddo
+	enddo
+	do i=1,3
+	cen(i)=cen(i)/float(max(ncen,1))
+	enddo
+	rview=0.
+	do il=1,nlodres
+	do ibio=1,nbiomat
+	if ((lodfirst(il).ge.icopy1(ibio)).and.
+     &      (lodfirst(il).le.icopy2(ibio))) then
+	call xform(lodcoord(1,il),biomat(1,1,ibio),matrixin,rx,ry,rz)
+	d=sqrt((rx-cen(1))**2+(ry-cen(2))**2+(rz-cen(3))**2)
+	rview=max(rview,d+max(lodbnd(il),lodrad(il)))
+	endif
+	enddo
+	enddo
+	sview=(float(npix)/2.-2.)/rview
+	write(6,*) 'orientation search: ',nsample,' views of ',
+     &    npix,' pixels'
+c --- view directions on a spiral from pole to pole
+c$omp parallel do schedule(dynamic)
+	do k=1,nsample
+	oangle(1,k)=asin(1.-2.*(float(k)-0.5)/float(nsample))
+     &              *180./3.141592
+	oangle(2,k)=mod(137.50776*float(k),360.)
+	call orview(oangle(1,k),oangle(2,k),npix,sview,cen,
+     &              nlodres,lodcoord,lodrad,lodatom,lodfirst,
+     &              nbiomat,biomat,icopy1,icopy2,
+     &              type,su,nsu,ligtype,l_diff_max,oscore(1,k))
+	enddo
+c$omp end parallel do
+c --- write the best views, best first
+	write(6,*) 'rank   xrot    yrot    zrot   score   area',
+     &    ' chains outline ligand'
+	do irank=1,ntop
+	best=-1.e30
+	kbest=0
+	do k=1,nsample
+	if (oscore(1,k).ge.0.) then
+	  score=0.
+	  do i=1,4
+	  score=score+worient(i)*oscore(i,k)
+	  enddo
+	  if (score.gt.best) then
+	    best=score
+	    kbest=k
+	  endif
+	endif
+	enddo
+	write(6,1301) 'orientation',irank,oangle(1,kbest),
+     &    oangle(2,kbest),0.,best,(oscore(i,kbest),i=1,4)
+c --- flag as written
+	oscore(1,kbest)=-1.
+	enddo
+	write(6,*) '*end orientation*'
+	flush(6)
+	goto 10
+ 1301	format(1x,a11,i4,3f8.1,f8.3,4f7.3)
+c--------------------------------------------------------------------
+c	MOLECULE: read and classify another molecule for a scene, issued
+c       after READ.  Same parameters as READ: coordinate file, then atom
+c       descriptor cards up to END, which apply only to this molecule.
+c       Molecules are numbered in order, READ is molecule 1.
+c       BIOMT records are not used: place copies with INSTANCE.
+c       Up to 100 molecules, including the one from READ.
+ 18	imolecule=1
+	if (nmol.lt.maxmol) goto 7001
+	read(5,113) inputfile
+	write(6,*) 'too many molecules, ignored: ',
+     &    inputfile(1:len_trim(inputfile))
+ 7070	read(5,7100) instring
+	if (instring(1:3).ne.'END') goto 7070
+	goto 10
+c--------------------------------------------------------------------
+c	INSTANCE placement of molecule copies in a scene, issued after
+c       READ and MOLECULE.  Replaces the BIOMT copies.  Each molecule
+c       is read once and drawn at every instance; each copy is
+c       separated from the others by subunit outlines.
+c param: ninst -- number of instances (up to 5000)
+c param: one card per instance: molecule number, rotation in degrees,
+c        applied as xrot, yrot, zrot cards given in that order, then
+c        translation in Angstroms
+c        2, 0.,90.,0., 40.,0.,-20.
+ 19	continue
+	read(5,*) ninst
+	ninst=min(ninst,maxcopy)
+	do k=1,ninst
+	read(5,*) imol(k),xr,yr,zr,(trans(i),i=1,3)
+	imol(k)=max(min(imol(k),nmol),1)
+	call clearmatrix(matrixin)
+	call rotcard(matrixin,1,xr)
+	call rotcard(matrixin,2,yr)
+	call rotcard(matrixin,3,zr)
+c --- biomat applies the rotation to column vectors, the cards to rows
+	do i=1,3
+	do j=1,3
+	biomat(i,j,k)=matrixin(j,i)
+	enddo
+	biomat(i,4,k)=trans(i)
+	enddo
+	enddo
+	write(6,*) 'instances: ',ninst,' of ',nmol,' molecules'
+	goto 10
+c--------------------------------------------------------------------
+c	ANTIALIAS: smooth the edges of silhouettes, colors and outlines
+c       by drawing edge pixels again with naa*naa samples.  Edge pixels
+c       are found from the atom buffer (a neighbor shows a different
+c       atom type, subunit, BIOMT copy or the background) and from the
+c       outline opacity (it changes by more than aadiff to a neighbor).
+c       Each sample is colored by the nearest atom among those seen in
+c       the 3x3 neighborhood, with outline opacity interpolated between
+c       pixels.  Not used for LOD spheres.
+c param: naa -- samples along x and y for edge pixels, 1 = off (up to 8)
+c param: aadiff -- step in outline opacity that marks an edge (0.1)
+ 20	continue
+	read(5,*) naa,aadiff
+	naa=max(min(naa,8),1)
+	write(6,*) 'anti-aliasing samples, outline step: ',naa,aadiff
+	goto 10
+c--------------------------------------------------------------------
+c	SAVE the atoms that have been read and classified as a binary
+c       structure file, issued after READ (and MOLECULE and INSTANCE).
+c       LOAD reads it back in a few block reads, without parsing the
+c       coordinate file or matching atom descriptor cards again.
+c       The file holds coordinates, atom types with their colors and
+c       radii, residue and subunit numbers, BIOMT or instance matrices
+c       and a content key.  Not available in model frame mode.
+c param: file name for the binary structure
+c param: content key kept in the header, e.g. a hash of the
+c        coordinate files and cards (up to 64 characters)
+ 22	read(5,113) filename
+	read(5,113) instring
+	if (iframe.ne.0) then
+	  write(6,*) 'SAVE is not available for model frames'
+	  goto 10
+	endif
+	nbsave=max(nbiomat,ninst)
+	open(2,file=filename,form='unformatted',access='stream',
+     &       status='replace')
+	write(2) 'ILLB',1,instring(1:64),n,nsu,nbiomat,ninst,nmol,ndes
+	write(2) ((coord(i,ia),i=1,3),ia=1,n)
+	write(2) (type(ia),ia=1,n),(res(ia),ia=1,n),(su(ia),ia=1,n)
+	write(2) (((biomat(i,j,k),i=1,4),j=1,4),k=1,nbsave)
+	write(2) (imol(k),k=1,ninst),(molfirst(k),k=1,nmol),
+     &           (mollast(k),k=1,nmol)
+	write(2) ((colortype(i,j),i=1,ndes),j=1,3),(radtype(i),i=1,ndes)
+	write(2) (atomdescriptor(i),i=1,ndes),(descriptor(i),i=1,ndes)
+	close(2)
+	write(6,*) 'structure saved: ',n,' atoms to: ',filename
+	goto 10
+c--------------------------------------------------------------------
+c	LOAD a binary structure file written by SAVE, in place of READ
+c       (and MOLECULE and INSTANCE)
+c param: file name of the binary structure
+ 23	read(5,113) filename
+	open(2,file=filename,form='unformatted',access='stream',
+     &       status='old')
+	read(2,end=7081,err=7081) magic,iversion,instring(1:64),n,nsu,
+     &          nbiomat,ninst,nmol,ndes
+	if ((magic.ne.'ILLB').or.(iversion.ne.1)) then
+	  write(6,*) 'not a binary structure file: ',
+     &      filename(1:len_trim(filename))
+	  goto 7080
+	endif
+c --- the counts must fit the arrays
+	nbsave=max(nbiomat,ninst)
+	if ((n.lt.0).or.(n.gt.350000).or.(ndes.lt.0).or.
+     &    (ndes.gt.1000).or.(nmol.lt.0).or.(nmol.gt.maxmol).or.
+     &    (nbiomat.lt.0).or.(ninst.lt.0).or.(nbsave.gt.maxcopy)) then
+	  write(6,*) 'structure file counts out of range: ',
+     &      n,' atoms ',ndes,' descriptors ',nmol,' molecules ',
+     &      nbsave,' copies'
+	  goto 7080
+	endif
+	do i=0,1000
+	do j=1,3
+	colortype(i,j)=.5
+	enddo
+	enddo
+	read(2,end=7081,err=7081) ((coord(i,ia),i=1,3),ia=1,n)
+	read(2,end=7081,err=7081) (type(ia),ia=1,n),(res(ia),ia=1,n),
+     &          (su(ia),ia=1,n)
+	read(2,end=7081,err=7081) (((biomat(i,j,k),i=1,4),j=1,4),
+     &          k=1,nbsave)
+	read(2,end=7081,err=7081) (imol(k),k=1,ninst),
+     &          (molfirst(k),k=1,nmol),(mollast(k),k=1,nmol)
+	read(2,end=7081,err=7081) ((colortype(i,j),i=1,ndes),j=1,3),
+     &          (radtype(i),i=1,ndes)
+	read(2,end=7081,err=7081) (atomdescriptor(i),i=1,ndes),
+     &          (descriptor(i),i=1,ndes)
+	close(2)
+c --- and so must the atom types and molecules they index
+	do ia=1,n
+	if ((type(ia).lt.0).or.(type(ia).gt.ndes)) goto 7082
+	enddo
+	do k=1,ninst
+	if ((imol(k).lt.1).or.(imol(k).gt.nmol)) goto 7082
+	enddo
+	do k=1,nmol
+	if ((molfirst(k).lt.1).or.(mollast(k).gt.n)) goto 7082
+	enddo
+	iframe=0
+	inext=0
+	write(6,*) ' atoms loaded: ',n,' from: ',filename
+	write(6,*) ' content key: ',instring(1:64)
+	write(6,*) ' atom descriptors: ',ndes
+	write(6,*) ' number of subunits: ',nsu
+	write(6,*)' '
+	goto 7015
+ 7081	write(6,*) 'structure file is truncated: ',
+     &    filename(1:len_trim(filename))
+	goto 7080
+ 7082	write(6,*) 'structure file is inconsistent: ',
+     &    filename(1:len_trim(filename))
+c --- a rejected file leaves no atoms
+ 7080	close(2)
+	n=0
+	nbiomat=0
+	ninst=0
+	nmol=0
+	goto 10
+c--------------------------------------------------------------------
+c	SWEEP of outline, fog and shadow styles.  The next CALCULATE
+c       rasterizes the atoms once, then shades the same depth and atom
+c       buffers with each style in turn.  Each style is written with
+c       "_s01", "_s02"... added to the file name, and a contact sheet
+c       of all styles, numbered in order, with "_sheet" added.
+c       The WORLD and ILLUSTRATE parameters are restored afterwards.
+c param: nsweep, ncolumn, idown -- number of styles (up to 64), styles
+c        per row of the contact sheet, shrink factor of the sheet tiles
+c        (increased if the sheet would be larger than 2000 pixels)
+c param: one card per style, 17 values:
+c        l_low,l_high,ikernel,l_diff_min,l_diff_max (as ILLUSTRATE)
+c        r_low,r_high,g_low,g_high,resdiff (as ILLUSTRATE)
+c        pfogh,pfogl (as WORLD)
+c        icone,pcone,coneangle,rcone,pshadowmax (as WORLD)
+ 24	continue
+	read(5,*) nsweep,ncolumn,idown
+	nsweep=max(min(nsweep,maxsweep),0)
+	ncolumn=max(min(ncolumn,nsweep),1)
+	idown=max(idown,1)
+	do k=1,nsweep
+	read(5,*) (swpar(i,k),i=1,17)
+	enddo
+	write(6,*) 'styles in sweep: ',nsweep
+	goto 10
 c--------------------------------------------------------------------
  111   	write (6,207) ' *begin calculation*'
-c --- if no BIOMT in file, use biomat 1 == identity matrix
-	nbiomat=max(nbiomat,1)
+	read(5,113) filename
+	kframe=0
+c --- each MODEL frame starts here
+ 116	kframe=kframe+1
+	if (iframe.ne.0) write(6,*) 'model frame: ',nmodel
+c --- copies to draw: BIOMT copies or scene instances
+	call copies(n,nbiomat,ninst,imol,molfirst,mollast,icopy1,icopy2)
 c ***** Populate conical shadow table ****
 	conemax=50.
 	do i=-51,51
@@ -504,51 +995,116 @@ c ***** Populate conical shadow table ****
 	enddo
 	enddo
 	 rtable(0,0)=10000.
-c ***** SCALE RADII *****
-	do i=1,ndes
-	 radtype(i)=radtype(i)*rscale
-	 if (radtype(i).gt.radius_max) radius_max=radtype(i)
- 119	enddo
-c ***** APPLY AUTOCENTERING and AUTOSIZING, if switched on *****
-	if (autocenter.gt.0) then
+c ***** TRANSFORM COORDINATES AND FIND BOUNDS *****
+c --- this part does not depend on the scale, so it is done once and
+c --- shared by every output size requested with the MULTISCALE command
+	ntrans=n*nbiomat
+	itrans=0
+	if ((nmulti.gt.0).and.(ntrans.le.maxtrans)) itrans=1
+c --- without kept coordinates, only the atoms of residues near the
+c --- edges are transformed: see subroutine sphbound
+	if ((autocenter.gt.0).and.(itrans.eq.0)) then
+	call sphbound(coord,nlodres,lodcoord,lodbnd,lodfirst,lodlast,
+     &                nbiomat,biomat,icopy1,icopy2,rm,bound,ncheck)
+	xmin=bound(1)
+	xmax=bound(2)
+	ymin=bound(3)
+	ymax=bound(4)
+	zmin=bound(5)
+	zmax=bound(6)
+	write(6,*) 'min coordinates : ',xmin,ymin,zmin
+	write(6,*) 'max coordinates : ',xmax,ymax,zmax
+	write(6,*) 'atoms checked for bounds: ',ncheck,' of ',ntrans
+	endif
+
+	if (itrans.ne.0) then
 
 	xmin=10000.
 	xmax=-10000.
- 	ymin=10000.
+	ymin=10000.
 	ymax=-10000.
- 	zmin=10000.
+	zmin=10000.
 	zmax=-10000.
 
 	do ia=1,n
 	do ibio=1,nbiomat
-c--apply biomat
-	rx=coord(1,ia)*biomat(1,1,ibio)+coord(2,ia)*biomat(1,2,ibio)+
-     &	   coord(3,ia)*biomat(1,3,ibio)+biomat(1,4,ibio)
-	ry=coord(1,ia)*biomat(2,1,ibio)+coord(2,ia)*biomat(2,2,ibio)+
-     &	   coord(3,ia)*biomat(2,3,ibio)+biomat(2,4,ibio)
-	rz=coord(1,ia)*biomat(3,1,ibio)+coord(2,ia)*biomat(3,2,ibio)+
-     &	   coord(3,ia)*biomat(3,3,ibio)+biomat(3,4,ibio)
-	
-c--apply rotation matrix
-	rx2=rx*rm(1,1)+ry*rm(2,1)+rz*rm(3,1)
-	ry2=rx*rm(1,2)+ry*rm(2,2)+rz*rm(3,2)
-	rz2=rx*rm(1,3)+ry*rm(2,3)+rz*rm(3,3)
+	if ((ia.lt.icopy1(ibio)).or.(ia.gt.icopy2(ibio))) goto 118
+	call xform(coord(1,ia),biomat(1,1,ibio),rm,rx2,ry2,rz2)
+	it=(ia-1)*nbiomat+ibio
+	tcoord(1,it)=rx2
+	tcoord(2,it)=ry2
+	tcoord(3,it)=rz2
 	 xmin=MIN(xmin,rx2)
 	 xmax=MAX(xmax,rx2)
 	 ymin=MIN(ymin,ry2)
 	 ymax=MAX(ymax,ry2)
 	 zmin=MIN(zmin,rz2)
 	 zmax=MAX(zmax,rz2)
-
+ 118	continue
 	enddo
 	enddo
 
 	write(6,*) 'min coordinates : ',xmin,ymin,zmin
 	write(6,*) 'max coordinates : ',xmax,ymax,zmax
+	write(6,*) 'transformed coordinates kept: ',ntrans
+	endif
+
+c --- MODEL frames keep the centering and size of the first frame
+	if (kframe.eq.1) then
+	  fbound(1)=xmin
+	  fbound(2)=xmax
+	  fbound(3)=ymin
+	  fbound(4)=ymax
+	  fbound(5)=zmin
+	  fbound(6)=zmax
+	else
+	  xmin=fbound(1)
+	  xmax=fbound(2)
+	  ymin=fbound(3)
+	  ymax=fbound(4)
+	  zmin=fbound(5)
+	  zmax=fbound(6)
+	endif
+
+	rscalein=rscale
+	ixsizein=ixsize
+	iysizein=iysize
+	imulti=0
+c ***** LOOP OVER OUTPUT SIZES STARTS HERE *****
+ 115	continue
+	rfactor=1.
+	outfile=filename
+	if (imulti.gt.0) then
+	  rfactor=multiscale(imulti)
+	  outfile=multifile(imulti)
+	  write(6,207) ' *next output size*'
+	endif
+	if (iframe.ne.0) then
+	  write(frametag,'(a1,i4.4)') '_',nmodel
+	  call suffixname(outfile,frametag,opafile)
+	  outfile=opafile
+	endif
+	opafile='opacity.pnm'
+	if ((imulti.gt.0).or.(iframe.ne.0))
+     &    call suffixname(outfile,'_opacity',opafile)
+	rscale=rscalein*rfactor
+	ixsize=ixsizein
+	iysize=iysizein
+c ***** SCALE RADII *****
+	radius_max=0.
+	do i=1,ndes
+	 radscale(i)=radtype(i)*rscale
+	 if (radscale(i).gt.radius_max) radius_max=radscale(i)
+ 119	enddo
+	lodlevel=0
+	if (radius_max.lt.plodres) lodlevel=1
+	if (radius_max.lt.plodsu) lodlevel=2
+c ***** APPLY AUTOCENTERING and AUTOSIZING, if switched on *****
+	if (autocenter.gt.0) then
 	xtranc=-xmin-(xmax-xmin)/2.
 	ytranc=-ymin-(ymax-ymin)/2.
 	if (autocenter.eq.1) then
- 	   ztranc=-zmax-radius_max-1.
+	   ztranc=-zmax-radius_max-1.
 	   write(6,*) 'automating centering'
 	endif
 	if (autocenter.eq.2) then
@@ -565,7 +1121,12 @@ c--apply rotation matrix
 	  ixsize=-2.*ixsize+2.*radius_max+(xmax-xmin)*rscale
 	  iysize=-2.*iysize+2.*radius_max+(ymax-ymin)*rscale
 	endif
- 	endif
+	endif
+
+	if ((ixsizein.gt.0).and.(iysizein.gt.0)) then
+	  ixsize=ixsizein*rfactor
+	  iysize=iysizein*rfactor
+	endif
 
 	ixsize=min(ixsize,3000)
 	iysize=min(iysize,3000)
@@ -575,17 +1136,7 @@ c ***** OPEN OUTPUT FILES *****
 	iysize=int(iysize/2)*2
 	  write(6,*) 'xsize and ysize: ',ixsize,iysize
 	  write(6,*)
-	 read(5,113) filename
-	 write(6,*) "output pnm filename: ",filename
-	 open(8,file=filename,form='formatted')
-	 write(8,1003) "P3"
  1003	 format(a2)
-	 write(8,1004) iysize,ixsize
-	 write(8,1004) 255
-	 open(9,file="opacity.pnm",form='formatted')
-	 write(9,1003) "P3"
-	 write(9,1004) iysize,ixsize
-	 write(9,1004) 255
  1004	format(2i5)
  113	format(a80)
 c ***** MAP SPHERICAL SURFACES OVER ATOMS *****
@@ -601,12 +1152,72 @@ c ***** MAP SPHERICAL SURFACES OVER ATOMS *****
 	enddo
 	enddo
 
-	if (n.gt.0) then
+	if ((n.gt.0).and.(lodlevel.eq.0)) then
+
+c ----- atoms to draw, as runs of atoms of one copy -----
+c --- without culling, every copy is one run.  When part of the
+c --- structure may be outside the view (fixed image size, translation
+c --- or clipping by the image plane), chain spheres of each copy are
+c --- tested first, then the residue spheres of chains in view, and
+c --- residues in view are merged into runs.
+	icull=1
+	if ((autocenter.eq.1).and.(ixsizein.le.0).and.(iysizein.le.0)
+     &    .and.(xtran.eq.0.).and.(ytran.eq.0.).and.(ztran.eq.0.))
+     &    icull=0
+	tview(1)=xtranc+xtran
+	tview(2)=ytranc+ytran
+	tview(3)=ztranc+ztran
+	nseg=0
+	if (icull.ne.0) then
+	do ibio=1,nbiomat
+	do kc=nlodres+1,nlodres+nlodsu
+	if ((lodfirst(kc).lt.icopy1(ibio)).or.
+     &      (lodfirst(kc).gt.icopy2(ibio))) goto 530
+	call sphview(lodcoord(1,kc),lodbnd(kc),biomat(1,1,ibio),rm,
+     &               tview,rscale,radius_max,ixsize,iysize,ivis)
+	if (ivis.eq.0) goto 530
+	kr=lodsub(kc)
+ 531	if ((kr.gt.nlodres).or.(lodlast(kr).gt.lodlast(kc))) goto 530
+	call sphview(lodcoord(1,kr),lodbnd(kr),biomat(1,1,ibio),rm,
+     &               tview,rscale,radius_max,ixsize,iysize,ivis)
+	if (ivis.ne.0) then
+	  iextend=0
+	  if (nseg.gt.0) then
+	    if ((iseg(3,nseg).eq.ibio).and.
+     &          (iseg(2,nseg).eq.lodfirst(kr)-1)) iextend=1
+	  endif
+	  if (iextend.ne.0) then
+	    iseg(2,nseg)=lodlast(kr)
+	  else
+	    if (nseg.eq.maxseg) goto 532
+	    nseg=nseg+1
+	    iseg(1,nseg)=lodfirst(kr)
+	    iseg(2,nseg)=lodlast(kr)
+	    iseg(3,nseg)=ibio
+	  endif
+	endif
+	kr=kr+1
+	goto 531
+ 530	continue
+	enddo
+	enddo
+	write(6,*) 'runs of atoms in view: ',nseg
+	goto 533
+	endif
+c --- no culling, or too many runs: draw every copy whole
+ 532	nseg=0
+	do ibio=1,nbiomat
+	nseg=nseg+1
+	iseg(1,nseg)=icopy1(ibio)
+	iseg(2,nseg)=icopy2(ibio)
+	iseg(3,nseg)=ibio
+	enddo
+ 533	continue
 
 c ----- create the spherical shading map for atom types -----
 	do irad=1,ndes
 	ic=1
-	irlim=int(radtype(irad))
+	irlim=int(radscale(irad))
 	if (irlim.gt.100) then
 	  write(6,*) 'atoms radius * scale > 100'
 	  stop
@@ -617,8 +1228,8 @@ c ----- create the spherical shading map for atom types -----
 	x=float(ix)
 	y=float(iy)
 	d=sqrt(x*x+y*y)
-	if (d.gt.radtype(irad)) goto 350
-	z=sqrt(radtype(irad)**2-d*d)
+	if (d.gt.radscale(irad)) goto 350
+	z=sqrt(radscale(irad)**2-d*d)
 	sphdat(ic,1)=x
 	sphdat(ic,2)=y
 	sphdat(ic,3)=z
@@ -630,23 +1241,20 @@ c ----- create the spherical shading map for atom types -----
 c ----- then map spherical surface over atoms of the proper type ------
 	icount=0
 
-	do ia=1,n
+	do kseg=1,nseg
+	ibio=iseg(3,kseg)
+	do ia=iseg(1,kseg),iseg(2,kseg)
 
-	if (type(ia).ne.irad) goto 500
+	if (type(ia).ne.irad) goto 511
 	icount=icount+1
-	do ibio=1,nbiomat
-c--apply biomat
-	rx=coord(1,ia)*biomat(1,1,ibio)+coord(2,ia)*biomat(1,2,ibio)+
-     &	   coord(3,ia)*biomat(1,3,ibio)+biomat(1,4,ibio)
-	ry=coord(1,ia)*biomat(2,1,ibio)+coord(2,ia)*biomat(2,2,ibio)+
-     &	   coord(3,ia)*biomat(2,3,ibio)+biomat(2,4,ibio)
-	rz=coord(1,ia)*biomat(3,1,ibio)+coord(2,ia)*biomat(3,2,ibio)+
-     &	   coord(3,ia)*biomat(3,3,ibio)+biomat(3,4,ibio)
-	
-c--apply rotation matrix
-	rx2=rx*rm(1,1)+ry*rm(2,1)+rz*rm(3,1)
-	ry2=rx*rm(1,2)+ry*rm(2,2)+rz*rm(3,2)
-	rz2=rx*rm(1,3)+ry*rm(2,3)+rz*rm(3,3)
+	if (itrans.ne.0) then
+	  it=(ia-1)*nbiomat+ibio
+	  rx2=tcoord(1,it)
+	  ry2=tcoord(2,it)
+	  rz2=tcoord(3,it)
+	else
+	  call xform(coord(1,ia),biomat(1,1,ibio),rm,rx2,ry2,rz2)
+	endif
 
 c--apply centering vector
 	rx2=rx2+xtranc
@@ -678,12 +1286,11 @@ c--apply translation and scaling
 
 	endif
 
-c -- ibio loop
+ 511	continue
+c -- ia loop
 	enddo
 
- 500	continue
-
-c -- ia loop
+c -- run loop
 	enddo
 
 	write(6,*) icount,' spheres added of type: ',irad
@@ -695,6 +1302,59 @@ c -- irad loop
 
  	endif
 
+c ----- or map residue or chain spheres, if atoms are too small -----
+	if ((n.gt.0).and.(lodlevel.gt.0)) then
+
+	ilod1=1
+	ilod2=nlodres
+	if (lodlevel.eq.2) then
+	  ilod1=nlodres+1
+	  ilod2=nlodres+nlodsu
+	endif
+
+	do ilod=ilod1,ilod2
+	rr=lodrad(ilod)*rscale
+	irlim=int(rr)
+	do ibio=1,nbiomat
+	if ((lodfirst(ilod).lt.icopy1(ibio)).or.
+     &      (lodfirst(ilod).gt.icopy2(ibio))) goto 521
+	call xform(lodcoord(1,ilod),biomat(1,1,ibio),rm,rx2,ry2,rz2)
+	rx2=(rx2+xtranc+xtran)*rscale
+	ry2=(ry2+ytranc+ytran)*rscale
+	rz2=(rz2+ztranc+ztran)*rscale
+
+	if (rz2.lt.0.) then
+	do ipx=-irlim-1,irlim+1
+	do ipy=-irlim-1,irlim+1
+	x=float(ipx)
+	y=float(ipy)
+	d=sqrt(x*x+y*y)
+	if (d.gt.rr) goto 520
+	z=sqrt(rr*rr-d*d)+rz2
+	x=x+rx2+float(ixsize)/2.
+	y=y+ry2+float(iysize)/2.
+	ix=int(x)
+	iy=int(y)
+	if ((x.gt.float(ixsize)).or.(x.lt.1.).or.
+     &      (y.gt.float(iysize)).or.(y.lt.1.)) goto 520
+	if (z.gt.zpix(ix,iy)) then
+	 zpix(ix,iy)=z
+	 atom(ix,iy)=lodatom(ilod)
+	 bio(ix,iy)=ibio
+	endif
+ 520	continue
+	enddo
+	enddo
+	endif
+
+ 521	continue
+	enddo
+	enddo
+
+	write(6,*) ilod2-ilod1+1,' coarse spheres added, level ',lodlevel
+
+	endif
+
 c***** CALCULATE SECOND DERIVATIVE OUTLINES ******
 c ---- find maximum and minimum z levels ---
 c	(note: I use a value of zpix=-10000. to distinguish background)
@@ -712,8 +1372,8 @@ c	(note: I use a value of zpix=-10000. to distinguish background)
 	write(6,*) 'zpix_min,zpix_max ',zpix_min,zpix_max
 
 c ***** PROCESSING OF THE IMAGE BEGINS HERE*****
-	l_diff_min=l_diff_min*rscale
-	l_diff_max=l_diff_max*rscale
+	l_dmin=l_diff_min*rscale
+	l_dmax=l_diff_max*rscale
 	write(6,*) ' Pixel processing beginning '
 	do ix=1,ixsize
 	do iy=1,iysize
@@ -721,7 +1381,59 @@ c ***** PROCESSING OF THE IMAGE BEGINS HERE*****
  2009	enddo
  1009	enddo
 
+c ***** each style of a SWEEP starts here *****
+	isweep=0
+ 1020	if (nsweep.gt.0) then
+	  isweep=isweep+1
+	  if (isweep.eq.1) call style(0,swsave,l_low,l_high,ikernel,
+     &      l_diff_min,l_diff_max,r_low,r_high,g_low,g_high,resdiff,
+     &      pfogh,pfogl,icone,pcone,coneangle,rcone,pshadowmax)
+	  call style(1,swpar(1,isweep),l_low,l_high,ikernel,
+     &      l_diff_min,l_diff_max,r_low,r_high,g_low,g_high,resdiff,
+     &      pfogh,pfogl,icone,pcone,coneangle,rcone,pshadowmax)
+	  illustrationflag=1
+	  pfogdiff=pfogh-pfogl
+	  l_dmin=l_diff_min*rscale
+	  l_dmax=l_diff_max*rscale
+	  write(6,1021) 'sweep style',isweep,(swpar(i,isweep),i=1,17)
+ 1021	  format(1x,a11,i4,17g11.4)
+	endif
+
+c --- the derivative kernels carry over from one pixel to the next,
+c --- starting from zero for each image
+	do i=-1,1
+	do j=-1,1
+	l(i,j)=0.
+	enddo
+	enddo
+c --- rows are shaded in parallel when compiled with -fopenmp.  The
+c --- kernels alone are first run through the image in serial order,
+c --- keeping their values at the start of each row, so that every
+c --- row starts from the same values as in the serial build
+c$    do ix=1,ixsize
+c$    do i=-1,1
+c$    do j=-1,1
+c$    lrow(i,j,ix)=l(i,j)
+c$    enddo
+c$    enddo
+c$    if ((illustrationflag.ne.0).and.(ix.gt.2).and.
+c$   &    (ix.lt.ixsize-1)) then
+c$    do iy=3,iysize-2
+c$    call lkernel(zpix,ix,iy,ikernel,l_dmin,l_dmax,l_low,l_high,l,
+c$   &    rl,l_opacity_ave)
+c$    enddo
+c$    endif
+c$    enddo
+c$omp parallel do schedule(dynamic)
+c$omp&  private(iy,i,j,pconetot,rzdiff,pfh,g_opacity,l_opacity,g,r,
+c$omp&  r_opacity,rl,l_opacity_ave,ixl,iyl,ixc,iyc,l,rd,ropacity,
+c$omp&  icolor,rcolor)
 	do ix=1,ixsize
+c$    do i=-1,1
+c$    do j=-1,1
+c$    l(i,j)=lrow(i,j,ix)
+c$    enddo
+c$    enddo
 	do iy=1,iysize
 
 c ***** CONICAL SHADOW TESTING *****
@@ -775,66 +1487,8 @@ c --- opacities are 1 for completely opaque ---
 c ***** SECOND DERIVATIVE OUTLINES *****
 	if ((ix.gt.2).and.(ix.lt.ixsize-1).and.
      &      (iy.gt.2).and.(iy.lt.iysize-1)) then
-	rl=0.
-	l_opacity_ave=0.
-	do ixl=-1,1
-	do iyl=-1,1
-	ixc=ix+ixl
-	iyc=iy+iyl
-
-	if (ikernel.eq.1) then
- 	 l(ixl,iyl)=abs(1./3. * ( 
-     &	 -0.8*zpix(ixc-1,iyc-1)-1.*zpix(ixc-1,iyc)-0.8*zpix(ixc-1,iyc+1)-
-     &	 1.0* zpix(ixc,iyc-1)+7.2*zpix(ixc,iyc)-1.0*zpix(ixc,iyc+1)-
-     &	 0.8* zpix(ixc+1,iyc-1)-1.*zpix(ixc+1,iyc)-0.8*zpix(ixc+1,iyc+1)
-     &     ))
-	endif
-
-	if (ikernel.eq.2) then
-	 l(ixl,iyl)=abs(1./3. * ( 
-     &	-0.8*zpix(ixc-1,iyc-1)-1.0*zpix(ixc-1,iyc)-0.8*zpix(ixc-1,iyc+1)-
-     &	 1.0*zpix(ixc,iyc-1)+8.8*zpix(ixc,iyc)-1.0*zpix(ixc,iyc+1)-
-     &	 0.8*zpix(ixc+1,iyc-1)-1.0*zpix(ixc+1,iyc)-0.8*zpix(ixc+1,iyc+1)-
-     &	 0.1*zpix(ixc+2,iyc-1)-0.2*zpix(ixc+2,iyc)-0.1*zpix(ixc+2,iyc+1)-
-     &	 0.1*zpix(ixc-2,iyc-1)-0.2*zpix(ixc-2,iyc)-0.1*zpix(ixc-2,iyc+1)-
-     &	 0.1*zpix(ixc-1,iyc+2)-0.2*zpix(ixc,iyc+2)-0.1*zpix(ixc+1,iyc+2)-
-     &	 0.1*zpix(ixc-1,iyc-2)-0.2*zpix(ixc,iyc-2)-0.1*zpix(ixc+1,iyc-2)
-     &     ))
-	endif
-
-	if (ikernel.eq.3) then
-	do i=-1,1
-	do j=-1,1
-		rd=abs(zpix(ix,iy)-zpix(ix+i,iy+j))
-		if (rd.gt.l_diff_min) then
-		rd=(rd-l_diff_min)/(l_diff_max-l_diff_min)
-		l(ixl,iyl)=l(ixl,iyl)+min(rd,1.)
-		endif
-	enddo
-	enddo
-	endif
-
-	if (ikernel.eq.4) then
-	do i=-2,2
-	do j=-2,2
-	 if (abs(i*j).ne.4) then
-		rd=abs(zpix(ix,iy)-zpix(ix+i,iy+j))
-		if (rd.gt.l_diff_min) then
-		rd=abs(zpix(ix,iy)-zpix(ix+i,iy+j))
-		rd=(rd-l_diff_min)/(l_diff_max-l_diff_min)
-		l(ixl,iyl)=l(ixl,iyl)+min(rd,1.)
-		endif
-	 endif
-	enddo
-	enddo
-	endif
-
-	l(ixl,iyl)=min((l(ixl,iyl)-l_low)/(l_high-l_low),1.)
-	l(ixl,iyl)=max(l(ixl,iyl),0.)
-	if (l(ixl,iyl).gt.0.) rl=rl+1.
-	l_opacity_ave=l_opacity_ave+l(ixl,iyl)
-	enddo
-	enddo
+	call lkernel(zpix,ix,iy,ikernel,l_dmin,l_dmax,l_low,l_high,l,
+     &    rl,l_opacity_ave)
 	if (rl.ge.6.) then
 	l_opacity=l_opacity_ave/6.
 	else
@@ -861,8 +1515,143 @@ c ----calculate pixel opacity
 	pix(ix,iy,4)=max(ropacity,l_opacity)
 
 	enddo
+c --- kept for anti-aliasing
+	if (naa.gt.1) then
+	  opix(ix,iy)=l_opacity
+	  spix(ix,iy)=pconetot
+	endif
 
  	enddo
+	enddo
+
+c ***** ANTI-ALIASING OF EDGE PIXELS *****
+	if ((naa.gt.1).and.(lodlevel.eq.0)) then
+	nedge=0
+	do ix=2,ixsize-1
+	do iy=2,iysize-1
+	ia=atom(ix,iy)
+c --- is this an edge pixel?
+	iedge=0
+	do i=-1,1
+	do j=-1,1
+	ja=atom(ix+i,iy+j)
+	if (ja.ne.ia) then
+	  if ((ia.eq.0).or.(ja.eq.0)) then
+	    iedge=1
+	  else if ((type(ja).ne.type(ia)).or.(su(ja).ne.su(ia)).or.
+     &      (bio(ix+i,iy+j).ne.bio(ix,iy))) then
+	    iedge=1
+	  endif
+	endif
+	if (abs(opix(ix+i,iy+j)-opix(ix,iy)).gt.aadiff) iedge=1
+	enddo
+	enddo
+	if (iedge.eq.0) goto 1010
+	nedge=nedge+1
+c --- candidate spheres: the atoms seen in the 3x3 neighborhood
+	ncand=0
+	do i=-1,1
+	do j=-1,1
+	ja=atom(ix+i,iy+j)
+	jb=bio(ix+i,iy+j)
+	if (ja.eq.0) goto 1011
+	do k=1,ncand
+	if ((icand(1,k).eq.ja).and.(icand(2,k).eq.jb)) goto 1011
+	enddo
+	if (itrans.ne.0) then
+	  it=(ja-1)*nbiomat+jb
+	  rx2=tcoord(1,it)
+	  ry2=tcoord(2,it)
+	  rz2=tcoord(3,it)
+	else
+	  call xform(coord(1,ja),biomat(1,1,jb),rm,rx2,ry2,rz2)
+	endif
+	ncand=ncand+1
+	icand(1,ncand)=ja
+	icand(2,ncand)=jb
+	cand(1,ncand)=(rx2+xtranc+xtran)*rscale+float(ixsize)/2.
+	cand(2,ncand)=(ry2+ytranc+ytran)*rscale+float(iysize)/2.
+	cand(3,ncand)=(rz2+ztranc+ztran)*rscale
+	cand(4,ncand)=radscale(type(ja))
+ 1011	continue
+	enddo
+	enddo
+c --- average the samples
+	do ic=1,4
+	aasum(ic)=0.
+	enddo
+	do isx=1,naa
+	do isy=1,naa
+	xs=float(ix)+(float(isx)-0.5)/float(naa)
+	ys=float(iy)+(float(isy)-0.5)/float(naa)
+	zs=-10000.
+	ka=0
+	do k=1,ncand
+	d=(xs-cand(1,k))**2+(ys-cand(2,k))**2
+	if ((d.le.cand(4,k)**2).and.(cand(3,k).lt.0.)) then
+	  z=cand(3,k)+sqrt(cand(4,k)**2-d)
+	  if (z.gt.zs) then
+	    zs=z
+	    ka=icand(1,k)
+	  endif
+	endif
+	enddo
+c --- outline opacity between the pixel centers
+	u=xs-0.5
+	v=ys-0.5
+	iu=int(u)
+	iv=int(v)
+	u=u-float(iu)
+	v=v-float(iv)
+	sop=(1.-u)*(1.-v)*opix(iu,iv)+u*(1.-v)*opix(iu+1,iv)+
+     &      (1.-u)*v*opix(iu,iv+1)+u*v*opix(iu+1,iv+1)
+	if (ka.ne.0) then
+	  zs=min(zs,0.)
+	  pfh=pfogh-(zpix_max-zs)/zpix_spread*pfogdiff
+	  if (zs.lt.zpix_min) pfh=1.
+	  do icolor=1,3
+	  rcolor=pfh*(spix(ix,iy)*colortype(type(ka),icolor))+
+     &           (1.-pfh)*rfog(icolor)
+	  aasum(icolor)=aasum(icolor)+(1.-sop)*rcolor
+	  enddo
+	  aasum(4)=aasum(4)+1.
+	else
+	  do icolor=1,3
+	  aasum(icolor)=aasum(icolor)+(1.-sop)*colortype(0,icolor)
+	  enddo
+	  aasum(4)=aasum(4)+sop
+	endif
+	enddo
+	enddo
+	do ic=1,4
+	pix(ix,iy,ic)=aasum(ic)/float(naa*naa)
+	enddo
+ 1010	continue
+	enddo
+	enddo
+	write(6,*) 'anti-aliased edge pixels: ',nedge
+	else if (naa.gt.1) then
+	write(6,*) 'no anti-aliasing for level of detail ',lodlevel
+	endif
+
+c ***** OPEN OUTPUT FILES *****
+	swfile=outfile
+	if (nsweep.gt.0) then
+	  write(frametag,'(a2,i2.2)') '_s',isweep
+	  call suffixname(outfile,frametag(1:4),swfile)
+	  call suffixname(swfile,'_opacity',opafile)
+	endif
+	 write(6,*) "output pnm filename: ",swfile
+	 open(8,file=swfile,form='formatted')
+	 write(8,1003) "P3"
+	 write(8,1004) iysize,ixsize
+	 write(8,1004) 255
+	 open(9,file=opafile,form='formatted')
+	 write(9,1003) "P3"
+	 write(9,1004) iysize,ixsize
+	 write(9,1004) 255
+c ***** OUTPUT OF THE IMAGE *****
+	do ix=1,ixsize
 
 c ***** output of a scan line *****
 c ----- PPM format -----
@@ -896,6 +1685,105 @@ c ----- diagnostic ------
 
  1000	enddo
 
+	close(8)
+	close(9)
+c ***** CONTACT SHEET OF A SWEEP *****
+	if (nsweep.gt.0) then
+	if (isweep.eq.1) then
+c --- tiles of ntx by nty pixels with a 4 pixel margin, on white
+	  nrow=(nsweep+ncolumn-1)/ncolumn
+ 1030	  ntx=ixsize/idown
+	  nty=iysize/idown
+	  msx=nrow*(ntx+4)+4
+	  msy=ncolumn*(nty+4)+4
+	  if ((msx.gt.maxsheet).or.(msy.gt.maxsheet)) then
+	    idown=idown+1
+	    goto 1030
+	  endif
+	  do ix=1,msx
+	  do iy=1,msy
+	  do ic=1,3
+	  sheet(ix,iy,ic)=1.
+	  enddo
+	  enddo
+	  enddo
+	endif
+c --- shrink this style into its tile by averaging idown x idown pixels
+	ix0=4+((isweep-1)/ncolumn)*(ntx+4)
+	iy0=4+mod(isweep-1,ncolumn)*(nty+4)
+	do ix=1,ntx
+	do iy=1,nty
+	do ic=1,3
+	rcolor=0.
+	do i=1,idown
+	do j=1,idown
+	rcolor=rcolor+pix((ix-1)*idown+i,(iy-1)*idown+j,ic)
+	enddo
+	enddo
+	sheet(ix0+ix,iy0+iy,ic)=rcolor/float(idown*idown)
+	enddo
+	enddo
+	enddo
+	if ((ntx.ge.16).and.(nty.ge.32))
+     &    call label(sheet,maxsheet,ix0+2,iy0+2,isweep)
+	if (isweep.lt.nsweep) goto 1020
+c --- all styles done: write the sheet, restore the parameters
+	call suffixname(outfile,'_sheet',swfile)
+	write(6,*) "contact sheet: ",swfile
+	open(8,file=swfile,form='formatted')
+	write(8,1003) "P3"
+	write(8,1004) msy,msx
+	write(8,1004) 255
+	do ix=1,msx
+	iscan=0
+	do iout=1,msy
+	do ic=1,3
+	iscan=iscan+1
+	scanline(iscan)=int(sheet(ix,iout,ic)*255.)
+	scanline(iscan)=min(scanline(iscan),255)
+	scanline(iscan)=max(scanline(iscan),0)
+	enddo
+	enddo
+	write(8,1002) (scanline(if),if=1,msy*3)
+	enddo
+	close(8)
+	call style(1,swsave,l_low,l_high,ikernel,
+     &      l_diff_min,l_diff_max,r_low,r_high,g_low,g_high,resdiff,
+     &      pfogh,pfogl,icone,pcone,coneangle,rcone,pshadowmax)
+	pfogdiff=pfogh-pfogl
+	nsweep=0
+	endif
+c --- clear the frame buffers, including the margins read by the
+c --- outline kernels, so the next image starts from a clean slate
+	do ix=-10,min(ixsize+10,3008)
+	do iy=-10,min(iysize+10,3008)
+	  pix(ix,iy,1)=0.
+	  pix(ix,iy,2)=0.
+	  pix(ix,iy,3)=0.
+	  pix(ix,iy,4)=0.
+	  zpix(ix,iy)=0.
+	  atom(ix,iy)=0
+	  bio(ix,iy)=0
+	enddo
+	enddo
+c ***** NEXT OUTPUT SIZE, if any *****
+	imulti=imulti+1
+	if (imulti.le.nmulti) goto 115
+	rscale=rscalein
+	ixsize=ixsizein
+	iysize=iysizein
+c ***** NEXT MODEL FRAME, if any *****
+	if ((iframe.ne.0).and.(ieof.eq.0)) then
+	  n=0
+	  nsu=0
+	  inext=1
+	  goto 7040
+	endif
+c --- marker for programs that feed several renders through one process
+ 117	write(6,*) '*end calculation*'
+	flush(6)
+	goto 10
+
  999	stop
 	end
 c--------------------------------------------------------------------
@@ -954,3 +1842,510 @@ c--------------------------------------------------------------------
 	enddo
 	return
 	end
+c--------------------------------------------------------------------
+	subroutine xform(c,bm,rm,rx2,ry2,rz2)
+	real*4 c(3),bm(4,4,*),rm(4,4)
+c--------------------------------------------------------------------
+c--apply biomat
+	rx=c(1)*bm(1,1,1)+c(2)*bm(1,2,1)+c(3)*bm(1,3,1)+bm(1,4,1)
+	ry=c(1)*bm(2,1,1)+c(2)*bm(2,2,1)+c(3)*bm(2,3,1)+bm(2,4,1)
+	rz=c(1)*bm(3,1,1)+c(2)*bm(3,2,1)+c(3)*bm(3,3,1)+bm(3,4,1)
+c--apply rotation matrix
+	rx2=rx*rm(1,1)+ry*rm(2,1)+rz*rm(3,1)
+	ry2=rx*rm(1,2)+ry*rm(2,2)+rz*rm(3,2)
+	rz2=rx*rm(1,3)+ry*rm(2,3)+rz*rm(3,3)
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine lkernel(zpix,ix,iy,ikernel,l_dmin,l_dmax,l_low,l_high,
+     &    l,rl,l_opacity_ave)
+	real*4 zpix(-10:3008,-10:3008),l(-1:1,-1:1)
+	real*4 l_dmin,l_dmax,l_low,l_high,l_opacity_ave
+c--------------------------------------------------------------------
+c --- second derivative outline kernels around pixel ix,iy.  Kernels
+c --- 3 and 4 add to the values of l left by the previous pixel.
+c --- rl is the number of kernels with some outline, l_opacity_ave
+c --- the sum of their opacities
+	rl=0.
+	l_opacity_ave=0.
+	do ixl=-1,1
+	do iyl=-1,1
+	ixc=ix+ixl
+	iyc=iy+iyl
+
+	if (ikernel.eq.1) then
+ 	 l(ixl,iyl)=abs(1./3. * ( 
+     &	 -0.8*zpix(ixc-1,iyc-1)-1.*zpix(ixc-1,iyc)-0.8*zpix(ixc-1,iyc+1)-
+     &	 1.0* zpix(ixc,iyc-1)+7.2*zpix(ixc,iyc)-1.0*zpix(ixc,iyc+1)-
+     &	 0.8* zpix(ixc+1,iyc-1)-1.*zpix(ixc+1,iyc)-0.8*zpix(ixc+1,iyc+1)
+     &     ))
+	endif
+
+	if (ikernel.eq.2) then
+	 l(ixl,iyl)=abs(1./3. * ( 
+     &	-0.8*zpix(ixc-1,iyc-1)-1.0*zpix(ixc-1,iyc)-0.8*zpix(ixc-1,iyc+1)-
+     &	 1.0*zpix(ixc,iyc-1)+8.8*zpix(ixc,iyc)-1.0*zpix(ixc,iyc+1)-
+     &	 0.8*zpix(ixc+1,iyc-1)-1.0*zpix(ixc+1,iyc)-0.8*zpix(ixc+1,iyc+1)-
+     &	 0.1*zpix(ixc+2,iyc-1)-0.2*zpix(ixc+2,iyc)-0.1*zpix(ixc+2,iyc+1)-
+     &	 0.1*zpix(ixc-2,iyc-1)-0.2*zpix(ixc-2,iyc)-0.1*zpix(ixc-2,iyc+1)-
+     &	 0.1*zpix(ixc-1,iyc+2)-0.2*zpix(ixc,iyc+2)-0.1*zpix(ixc+1,iyc+2)-
+     &	 0.1*zpix(ixc-1,iyc-2)-0.2*zpix(ixc,iyc-2)-0.1*zpix(ixc+1,iyc-2)
+     &     ))
+	endif
+
+	if (ikernel.eq.3) then
+	do i=-1,1
+	do j=-1,1
+		rd=abs(zpix(ix,iy)-zpix(ix+i,iy+j))
+		if (rd.gt.l_dmin) then
+		rd=(rd-l_dmin)/(l_dmax-l_dmin)
+		l(ixl,iyl)=l(ixl,iyl)+min(rd,1.)
+		endif
+	enddo
+	enddo
+	endif
+
+	if (ikernel.eq.4) then
+	do i=-2,2
+	do j=-2,2
+	 if (abs(i*j).ne.4) then
+		rd=abs(zpix(ix,iy)-zpix(ix+i,iy+j))
+		if (rd.gt.l_dmin) then
+		rd=abs(zpix(ix,iy)-zpix(ix+i,iy+j))
+		rd=(rd-l_dmin)/(l_dmax-l_dmin)
+		l(ixl,iyl)=l(ixl,iyl)+min(rd,1.)
+		endif
+	 endif
+	enddo
+	enddo
+	endif
+
+	l(ixl,iyl)=min((l(ixl,iyl)-l_low)/(l_high-l_low),1.)
+	l(ixl,iyl)=max(l(ixl,iyl),0.)
+	if (l(ixl,iyl).gt.0.) rl=rl+1.
+	l_opacity_ave=l_opacity_ave+l(ixl,iyl)
+	enddo
+	enddo
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine suffixname(name,suffix,out)
+	character*(*) name,suffix,out
+c--------------------------------------------------------------------
+c --- insert suffix before the extension: 2hhb.pnm -> 2hhb_opacity.pnm
+	nl=len_trim(name)
+	idot=index(name(1:nl),'.',.true.)
+	islash=index(name(1:nl),'/',.true.)
+	if (idot.le.islash) idot=nl+1
+	out=name(1:idot-1)//suffix//name(idot:nl)
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine style(iset,p,l_low,l_high,ikernel,
+     &      l_diff_min,l_diff_max,r_low,r_high,g_low,g_high,resdiff,
+     &      pfogh,pfogl,icone,pcone,coneangle,rcone,pshadowmax)
+	real*4 p(17),l_low,l_high,l_diff_min,l_diff_max
+c--------------------------------------------------------------------
+c --- copy the outline, fog and shadow parameters of a SWEEP style
+c --- from p (iset=1) or into p (iset=0)
+	if (iset.eq.1) then
+	  l_low=p(1)
+	  l_high=p(2)
+	  ikernel=nint(p(3))
+	  l_diff_min=p(4)
+	  l_diff_max=p(5)
+	  r_low=p(6)
+	  r_high=p(7)
+	  g_low=p(8)
+	  g_high=p(9)
+	  resdiff=p(10)
+	  pfogh=p(11)
+	  pfogl=p(12)
+	  icone=nint(p(13))
+	  pcone=p(14)
+	  coneangle=p(15)
+	  rcone=p(16)
+	  pshadowmax=p(17)
+	else
+	  p(1)=l_low
+	  p(2)=l_high
+	  p(3)=float(ikernel)
+	  p(4)=l_diff_min
+	  p(5)=l_diff_max
+	  p(6)=r_low
+	  p(7)=r_high
+	  p(8)=g_low
+	  p(9)=g_high
+	  p(10)=resdiff
+	  p(11)=pfogh
+	  p(12)=pfogl
+	  p(13)=float(icone)
+	  p(14)=pcone
+	  p(15)=coneangle
+	  p(16)=rcone
+	  p(17)=pshadowmax
+	endif
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine label(sheet,msheet,ix0,iy0,num)
+	real*4 sheet(msheet,msheet,3)
+	integer*4 ifont(5,0:9),idig(3)
+c--------------------------------------------------------------------
+c --- number a tile of the contact sheet: black digits from a 3x5
+c --- font, drawn two pixels per dot on a white box
+	data ifont/7,5,5,5,7, 2,6,2,2,7, 7,1,7,4,7, 7,1,7,1,7,
+     &             5,5,7,1,1, 7,4,7,1,7, 7,4,7,5,7, 7,1,1,1,1,
+     &             7,5,7,5,7, 7,5,7,1,7/
+	ndig=0
+	k=num
+ 10	ndig=ndig+1
+	idig(ndig)=mod(k,10)
+	k=k/10
+	if ((k.gt.0).and.(ndig.lt.3)) goto 10
+	do ix=0,11
+	do iy=0,8*ndig+1
+	do ic=1,3
+	sheet(ix0+ix,iy0+iy,ic)=1.
+	enddo
+	enddo
+	enddo
+	do id=1,ndig
+	do irow=1,5
+	do icol=0,2
+	if (mod(ifont(irow,idig(ndig-id+1))/2**(2-icol),2).eq.1) then
+	  do i=0,1
+	  do j=0,1
+	  do ic=1,3
+	  sheet(ix0+2*irow+i-1,iy0+8*(id-1)+2*icol+j+2,ic)=0.
+	  enddo
+	  enddo
+	  enddo
+	endif
+	enddo
+	enddo
+	enddo
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine coarsen(n,coord,type,res,su,radtype,ilevel,
+     &                     lodcoord,lodrad,lodbnd,lodatom,
+     &                     lodfirst,lodlast,nlod)
+	real*4 coord(3,*),radtype(*),lodcoord(3,*),lodrad(*),lodbnd(*)
+	integer*4 type(*),res(0:*),su(0:*),lodatom(*)
+	integer*4 lodfirst(*),lodlast(*)
+	integer*4 kount(0:1000)
+c--------------------------------------------------------------------
+c --- one sphere per residue (ilevel=1) or per chain (ilevel=2):
+c --- atoms are grouped in the order they were read, a group ends when
+c --- the subunit (or, for residues, the residue number) changes
+	do k=0,1000
+	kount(k)=0
+	enddo
+	nlod=0
+	ia1=1
+	do ia=1,n
+	iend=0
+	if (ia.eq.n) then
+	  iend=1
+	else
+	  if (su(ia+1).ne.su(ia)) iend=1
+	  if ((ilevel.eq.1).and.(res(ia+1).ne.res(ia))) iend=1
+	endif
+	if (iend.ne.0) then
+c --- center, volume and most common atom type of the group
+	  x=0.
+	  y=0.
+	  z=0.
+	  v=0.
+	  ibest=ia1
+	  do j=ia1,ia
+	   x=x+coord(1,j)
+	   y=y+coord(2,j)
+	   z=z+coord(3,j)
+	   v=v+radtype(type(j))**3
+	   kount(type(j))=kount(type(j))+1
+	   if (kount(type(j)).gt.kount(type(ibest))) ibest=j
+	  enddo
+	  do j=ia1,ia
+	   kount(type(j))=0
+	  enddo
+	  rn=float(ia-ia1+1)
+	  nlod=nlod+1
+	  lodcoord(1,nlod)=x/rn
+	  lodcoord(2,nlod)=y/rn
+	  lodcoord(3,nlod)=z/rn
+	  lodrad(nlod)=v**(1./3.)
+	  lodatom(nlod)=ibest
+	  lodfirst(nlod)=ia1
+	  lodlast(nlod)=ia
+c --- bounding radius: distance from the center to the farthest atom
+	  r2=0.
+	  do j=ia1,ia
+	   r2=max(r2,(coord(1,j)-lodcoord(1,nlod))**2+
+     &               (coord(2,j)-lodcoord(2,nlod))**2+
+     &               (coord(3,j)-lodcoord(3,nlod))**2)
+	  enddo
+	  lodbnd(nlod)=sqrt(r2)
+	  ia1=ia+1
+	endif
+	enddo
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine sphbound(coord,nlod,lodcoord,lodbnd,lodfirst,lodlast,
+     &                      nbiomat,biomat,icopy1,icopy2,rm,bound,
+     &                      ncheck)
+	real*4 coord(3,*),lodcoord(3,*),lodbnd(*),biomat(4,4,*),rm(4,4)
+	integer*4 lodfirst(*),lodlast(*),icopy1(*),icopy2(*)
+	real*4 bound(6),hi(6),rb(3)
+c--------------------------------------------------------------------
+c --- min and max of the transformed atom coordinates, as found by
+c --- transforming every atom, but only the atoms of residues that can
+c --- reach an edge are transformed.  Every atom lies within lodbnd of
+c --- its residue center, so each residue gives a range for each axis;
+c --- a residue whose range cannot reach past an edge guaranteed by
+c --- another residue is skipped.
+c --- first pass: edges that some atom is sure to reach
+	do k=1,3
+	hi(2*k-1)=10000.
+	hi(2*k)=-10000.
+	enddo
+	do il=1,nlod
+	rr=lodbnd(il)*1.001+0.001
+	do ibio=1,nbiomat
+	if ((lodfirst(il).lt.icopy1(ibio)).or.
+     &      (lodfirst(il).gt.icopy2(ibio))) goto 10
+	call xform(lodcoord(1,il),biomat(1,1,ibio),rm,rb(1),rb(2),rb(3))
+	do k=1,3
+	hi(2*k-1)=min(hi(2*k-1),rb(k)+rr)
+	hi(2*k)=max(hi(2*k),rb(k)-rr)
+	enddo
+ 10	continue
+	enddo
+	enddo
+c --- second pass: atoms of residues that may reach past those edges
+	do k=1,3
+	bound(2*k-1)=10000.
+	bound(2*k)=-10000.
+	enddo
+	ncheck=0
+	do il=1,nlod
+	rr=lodbnd(il)*1.001+0.001
+	do ibio=1,nbiomat
+	if ((lodfirst(il).lt.icopy1(ibio)).or.
+     &      (lodfirst(il).gt.icopy2(ibio))) goto 20
+	call xform(lodcoord(1,il),biomat(1,1,ibio),rm,rb(1),rb(2),rb(3))
+	iedge=0
+	do k=1,3
+	if (rb(k)-rr.le.hi(2*k-1)) iedge=1
+	if (rb(k)+rr.ge.hi(2*k)) iedge=1
+	enddo
+	if (iedge.ne.0) then
+	do ia=lodfirst(il),lodlast(il)
+	call xform(coord(1,ia),biomat(1,1,ibio),rm,rx2,ry2,rz2)
+	ncheck=ncheck+1
+	bound(1)=min(bound(1),rx2)
+	bound(2)=max(bound(2),rx2)
+	bound(3)=min(bound(3),ry2)
+	bound(4)=max(bound(4),ry2)
+	bound(5)=min(bound(5),rz2)
+	bound(6)=max(bound(6),rz2)
+	enddo
+	endif
+ 20	continue
+	enddo
+	enddo
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine sphview(c,bnd,biomat,rm,tview,rscale,rpad,ixsize,
+     &                     iysize,ivis)
+	real*4 c(3),biomat(4,4),rm(4,4),tview(3)
+c--------------------------------------------------------------------
+c --- ivis=1 if some atom of a sphere of atom centers (center c,
+c --- radius bnd) may be drawn: drawn with a radius up to rpad pixels it
+c --- reaches the image, and its center lies below the image plane z=0.
+c --- The margins are those of sphbound.
+	call xform(c,biomat,rm,rx,ry,rz)
+	rb=(bnd*1.001+0.001)*rscale
+	rr=rb+rpad+1.
+	rx=(rx+tview(1))*rscale+float(ixsize)/2.
+	ry=(ry+tview(2))*rscale+float(iysize)/2.
+	rz=(rz+tview(3))*rscale
+	ivis=1
+	if ((rx+rr.lt.1.).or.(rx-rr.gt.float(ixsize)).or.
+     &      (ry+rr.lt.1.).or.(ry-rr.gt.float(iysize)).or.
+     &      (rz-rb.ge.0.)) ivis=0
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine rotcard(m,iaxis,angle)
+	real*4 m(4,4),matrixin(4,4)
+c--------------------------------------------------------------------
+c --- concatenate a rotation, as given on an xrot (1), yrot (2) or zrot (3) card
+	call clearmatrix(matrixin)
+c --minus sign is because original rotations were left-handed! (warning: postdoc code)
+	a=-angle*3.141592/180.
+	if (iaxis.eq.1) then
+	matrixin(2,2)=cos(a)
+	matrixin(2,3)=-sin(a)
+	matrixin(3,2)=sin(a)
+	matrixin(3,3)=cos(a)
+	endif
+	if (iaxis.eq.2) then
+	matrixin(1,1)=cos(a)
+	matrixin(1,3)=sin(a)
+	matrixin(3,1)=-sin(a)
+	matrixin(3,3)=cos(a)
+	endif
+	if (iaxis.eq.3) then
+	matrixin(1,1)=cos(a)
+	matrixin(1,2)=-sin(a)
+	matrixin(2,1)=sin(a)
+	matrixin(2,2)=cos(a)
+	endif
+	call catenate(m,matrixin)
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine orview(xr,yr,npix,sc,cen,nlod,lodcoord,lodrad,lodatom,
+     &                    lodfirst,nbiomat,biomat,icopy1,icopy2,
+     &                    type,su,nsu,ligtype,dzedge,terms)
+	parameter (maxo=256,maxseen=50000)
+	real*4 cen(3),lodcoord(3,*),lodrad(*),biomat(4,4,*),terms(4)
+	integer*4 lodatom(*),lodfirst(*),icopy1(*),icopy2(*)
+	integer*4 type(*),su(0:*),ligtype(*)
+	real*4 r(4,4),bid(4,4),zb(0:maxo+1,0:maxo+1)
+	integer*4 kb(0:maxo+1,0:maxo+1),iseen(maxseen)
+c--------------------------------------------------------------------
+c --- draw one view of the residue spheres into a small depth buffer
+c --- and score it.  Called in parallel, so everything is local.
+c --- rotation as given by the cards "xrot xr" then "yrot yr"
+	call clearmatrix(r)
+	call rotcard(r,1,xr)
+	call rotcard(r,2,yr)
+	call clearmatrix(bid)
+	call xform(cen,bid,r,cx,cy,cz)
+	do ix=0,npix+1
+	do iy=0,npix+1
+	zb(ix,iy)=-1.e6
+	kb(ix,iy)=0
+	enddo
+	enddo
+c --- buffer keys are subunit and BIOMT copy
+	do il=1,nlod
+	rr=lodrad(il)*sc
+	irlim=int(rr)
+	do ibio=1,nbiomat
+	if ((lodfirst(il).lt.icopy1(ibio)).or.
+     &      (lodfirst(il).gt.icopy2(ibio))) goto 11
+	key=(ibio-1)*nsu+su(lodatom(il))
+	call xform(lodcoord(1,il),biomat(1,1,ibio),r,x0,y0,z0)
+	x0=(x0-cx)*sc+float(npix)/2.
+	y0=(y0-cy)*sc+float(npix)/2.
+	z0=(z0-cz)*sc
+	do ipx=-irlim-1,irlim+1
+	do ipy=-irlim-1,irlim+1
+	d=sqrt(float(ipx*ipx+ipy*ipy))
+	if (d.gt.rr) goto 10
+	ix=int(x0+float(ipx))
+	iy=int(y0+float(ipy))
+	if ((ix.lt.1).or.(ix.gt.npix).or.(iy.lt.1).or.(iy.gt.npix))
+     &    goto 10
+	z=z0+sqrt(rr*rr-d*d)
+	if (z.gt.zb(ix,iy)) then
+	  zb(ix,iy)=z
+	  kb(ix,iy)=key
+	endif
+ 10	continue
+	enddo
+	enddo
+ 11	continue
+	enddo
+	enddo
+c --- coverage, visible subunits and outline pixels
+	nkey=min(nsu*nbiomat,maxseen)
+	do k=1,nkey
+	iseen(k)=0
+	enddo
+c --- subunits that each copy could show
+	nposs=0
+	do ibio=1,nbiomat
+	nposs=nposs+su(icopy2(ibio))-su(icopy1(ibio))+1
+	enddo
+	ncov=0
+	nedge=0
+	nvsu=0
+	dz=dzedge*sc
+	do ix=1,npix
+	do iy=1,npix
+	k=kb(ix,iy)
+	if (k.ne.0) then
+	  ncov=ncov+1
+	  if ((k.le.nkey).and.(iseen(k).eq.0)) then
+	    iseen(k)=1
+	    nvsu=nvsu+1
+	  endif
+	  if ((kb(ix-1,iy).ne.k).or.(kb(ix+1,iy).ne.k).or.
+     &        (kb(ix,iy-1).ne.k).or.(kb(ix,iy+1).ne.k).or.
+     &        (abs(zb(ix,iy)-zb(ix-1,iy)).gt.dz).or.
+     &        (abs(zb(ix,iy)-zb(ix+1,iy)).gt.dz).or.
+     &        (abs(zb(ix,iy)-zb(ix,iy-1)).gt.dz).or.
+     &        (abs(zb(ix,iy)-zb(ix,iy+1)).gt.dz)) nedge=nedge+1
+	endif
+	enddo
+	enddo
+c --- HETATM residues whose sphere is in front at its center
+	nlig=0
+	nvis=0
+	do il=1,nlod
+	if (ligtype(type(lodatom(il))).ne.0) then
+	rr=lodrad(il)*sc
+	do ibio=1,nbiomat
+	if ((lodfirst(il).lt.icopy1(ibio)).or.
+     &      (lodfirst(il).gt.icopy2(ibio))) goto 12
+	call xform(lodcoord(1,il),biomat(1,1,ibio),r,x0,y0,z0)
+	ix=int((x0-cx)*sc+float(npix)/2.)
+	iy=int((y0-cy)*sc+float(npix)/2.)
+	z0=(z0-cz)*sc+rr
+	if ((ix.ge.1).and.(ix.le.npix).and.(iy.ge.1).and.
+     &      (iy.le.npix)) then
+	  nlig=nlig+1
+	  if (z0.ge.zb(ix,iy)-1.) nvis=nvis+1
+	endif
+ 12	continue
+	enddo
+	endif
+	enddo
+	terms(1)=float(ncov)/float(npix*npix)
+	terms(2)=float(nvsu)/float(max(min(nposs,maxseen),1))
+	terms(3)=0.
+	if (ncov.gt.0) terms(3)=float(nedge)/float(ncov)
+	terms(4)=0.
+	if (nlig.gt.0) terms(4)=float(nvis)/float(nlig)
+	return
+	end
+c--------------------------------------------------------------------
+	subroutine copies(n,nbiomat,ninst,imol,molfirst,mollast,
+     &                    icopy1,icopy2)
+	integer*4 imol(*),molfirst(*),mollast(*),icopy1(*),icopy2(*)
+c--------------------------------------------------------------------
+c --- range of atoms drawn by each copy: every atom for BIOMT copies,
+c --- the atoms of its molecule for scene instances
+	if (ninst.gt.0) then
+	  nbiomat=ninst
+	  do k=1,ninst
+	  icopy1(k)=molfirst(imol(k))
+	  icopy2(k)=mollast(imol(k))
+	  enddo
+	else
+c --- if no BIOMT in file, use biomat 1 == identity matrix
+	  nbiomat=max(nbiomat,1)
+	  do k=1,nbiomat
+	  icopy1(k)=1
+	  icopy2(k)=n
+	  enddo
+	endif
+	return
+	end
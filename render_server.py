@@ -0,0 +1,683 @@
+"""Local render service for ILLUSTRATE.
+
+Keeps a small pool of long-lived ``illustrate`` processes, each with one
+structure already read and classified, and feeds them the view, world,
+illustrate and calculate cards of each request over stdin.  The app talks
+to it over localhost HTTP instead of spawning a new process per preview.
+
+Run it next to the ``illustrate`` executable:
+
+    python render_server.py --port 8765
+
+POST /render   JSON {"input": "<command file text>", "timeout": 30}
+               returns the rendered image as PNG (with transparency)
+               add "width": 600 (and "format": "webp" or "png") for a
+               downscaled preview, cached with the render
+GET  /stats    JSON with queue depth, cache and latency statistics
+
+Structures are compiled to binary files (SAVE command) the first time they
+are read, and later workers LOAD them instead of parsing the PDB file.
+
+    python render_server.py --check original.inp 2hhb_fixed.inp
+
+renders command files one after another on warm workers and compares each
+image with a new ``illustrate`` run, to catch state left over between
+requests.
+"""
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+END_MARKER = '*end calculation*'
+STRUCTURE_DIR = os.environ.get('ILLUSTRATE_STRUCTURES',
+                               os.path.expanduser('~/.cache/illustrate'))
+STRUCTURE_LIMIT_MB = int(os.environ.get('ILLUSTRATE_STRUCTURES_MB', 2048))
+STRUCTURE_MAGIC = b'ILLB'
+STRUCTURE_VERSION = 1
+PREVIEW_TYPES = {'webp': 'image/webp', 'png': 'image/png'}
+# commands that write files other than the image, or replace the atoms of
+# a worker; the service does not accept them in a render
+UNSUPPORTED = {'swe': 'sweep', 'mul': 'multiscale', 'sav': 'save',
+               'loa': 'load', 'rea': 'a second read'}
+
+
+class RenderError(Exception):
+    """Raised when a render fails, times out or exceeds its limits."""
+
+
+def split_input(input_text):
+    """Split a command file into the READ block and the per-render cards.
+
+    The READ block (MODEL selection, file name and selection cards up to END,
+    plus any scene MOLECULE and INSTANCE commands) determines the parsed and
+    classified structure; everything else describes one render. PDB paths are
+    made absolute because workers run in their own directory. Returns the
+    READ block, the PDB paths and the render cards. Raises RenderError for
+    MODEL frames and for the commands in UNSUPPORTED.
+    """
+    lines = input_text.splitlines()
+    read_block, render_lines = [], []
+    model_block = []
+    pdb_paths = []
+    i = 0
+    while i < len(lines):
+        if lines[i][:3].lower() == 'mod' and not read_block:
+            model_block = lines[i:i + 2]
+            fields = model_block[-1].replace(',', ' ').split()
+            if len(fields) > 2 and fields[2] != '0':
+                raise RenderError("model frames are not supported by the render service")
+            i += 2
+            continue
+        command = lines[i][:3].lower()
+        if (command == 'rea' and not read_block) or (command == 'mol' and read_block):
+            pdb_paths.append(os.path.abspath(lines[i + 1].strip()))
+            read_block.append(lines[i])
+            read_block.append(pdb_paths[-1])
+            i += 2
+            while i < len(lines):
+                read_block.append(lines[i])
+                i += 1
+                if read_block[-1][:3] == 'END':
+                    break
+            continue
+        if command == 'ins' and read_block:
+            count = int(lines[i + 1].split(',')[0])
+            read_block.extend(lines[i:i + 2 + count])
+            i += 2 + count
+            continue
+        if command in UNSUPPORTED and not (render_lines and render_lines[-1][:3].lower() == 'cal'):
+            raise RenderError(f"{UNSUPPORTED[command]} is not supported by the render service")
+        render_lines.append(lines[i])
+        i += 1
+    if not read_block:
+        raise RenderError("command file has no read command")
+    return model_block + read_block, pdb_paths, render_lines
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def structure_key(read_block, pdb_digests):
+    """Return the content hash of a READ block and its coordinate files.
+
+    pdb_digests maps each PDB path of the block to the digest of the file.
+    The paths are replaced by the digests, so the same structure uploaded
+    under another temporary name has the same key.
+    """
+    return hashlib.sha256(
+        '\n'.join(pdb_digests.get(line, line) for line in read_block).encode()
+    ).hexdigest()
+
+
+def prune_structures(structure_dir, limit_mb=STRUCTURE_LIMIT_MB):
+    """Remove the least recently used structure files over limit_mb."""
+    try:
+        entries = [e for e in os.scandir(structure_dir)
+                   if e.name.endswith('.ilb') and e.is_file()]
+    except OSError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    total = 0
+    for entry in entries:
+        total += entry.stat().st_size
+        if total > limit_mb * 1024 * 1024:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def structure_block(read_block, key, structure_dir=STRUCTURE_DIR,
+                    limit_mb=STRUCTURE_LIMIT_MB):
+    """Return the cards that give an illustrate process its structure.
+
+    LOAD of the compiled structure file when it holds this content hash,
+    otherwise the READ block followed by SAVE, which compiles it for the
+    next time. Files are used least recently first when the directory
+    grows over limit_mb. Returns the cards and the path of the structure
+    file.
+    """
+    # illustrate reads file names of up to 80 characters, the header
+    # holds the full hash; workers run in their own directory
+    structure_dir = os.path.abspath(structure_dir)
+    path = os.path.join(structure_dir, key[:16] + '.ilb')
+    try:
+        if load_structure(path)['key'] == key:
+            os.utime(path)
+            return ['load', path], path
+    except (OSError, RenderError):
+        pass
+    os.makedirs(structure_dir, exist_ok=True)
+    prune_structures(structure_dir, limit_mb)
+    return read_block + ['save', path, key], path
+
+
+def load_structure(path):
+    """Memory-map a binary structure file written by the SAVE command.
+
+    Returns a dict with the header counts and content hash ('key') and
+    numpy arrays viewing the mapped file: coord (n x 3), type, res, su,
+    biomat (copies x 4 x 4), imol, molfirst, mollast, color (types x 3)
+    and radius. Raises RenderError if the file is not a complete
+    structure file.
+    """
+    import numpy as np
+    header = np.dtype([('magic', 'S4'), ('version', '<i4'), ('key', 'S64'),
+                       ('n', '<i4'), ('nsu', '<i4'), ('nbiomat', '<i4'),
+                       ('ninst', '<i4'), ('nmol', '<i4'), ('ndes', '<i4')])
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < header.itemsize:
+            raise RenderError(f"{path} is not a binary structure file")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    head = np.frombuffer(data, header, 1)[0]
+    if head['magic'] != STRUCTURE_MAGIC or head['version'] != STRUCTURE_VERSION:
+        raise RenderError(f"{path} is not a binary structure file")
+    n, ndes, ninst, nmol = (int(head[k]) for k in ('n', 'ndes', 'ninst', 'nmol'))
+    ncopy = max(int(head['nbiomat']), ninst)
+    structure = {'key': head['key'].decode().strip(), 'nsu': int(head['nsu']),
+                 'nbiomat': int(head['nbiomat']), 'ninst': ninst}
+    offset = header.itemsize
+    # blocks in the order SAVE writes them, Fortran arrays in column order
+    for name, dtype, shape in [('coord', '<f4', (n, 3)), ('type', '<i4', (n,)),
+                               ('res', '<i4', (n,)), ('su', '<i4', (n,)),
+                               ('biomat', '<f4', (ncopy, 4, 4)),
+                               ('imol', '<i4', (ninst,)),
+                               ('molfirst', '<i4', (nmol,)),
+                               ('mollast', '<i4', (nmol,)),
+                               ('color', '<f4', (3, ndes)),
+                               ('radius', '<f4', (ndes,)),
+                               ('atomdescriptor', 'S6', (ndes,)),
+                               ('descriptor', 'S10', (ndes,))]:
+        count = int(np.prod(shape))
+        if offset + count * np.dtype(dtype).itemsize > len(data):
+            raise RenderError(f"{path} is truncated")
+        structure[name] = np.frombuffer(data, dtype, count, offset).reshape(shape)
+        offset += count * np.dtype(dtype).itemsize
+    structure['biomat'] = structure['biomat'].transpose(0, 2, 1)
+    structure['color'] = structure['color'].T
+    return structure
+
+
+def read_ppm(path):
+    """Read the plain (P3) PPM written by illustrate as an HxWx3 uint8 array.
+
+    Much faster than PIL's plain PPM decoder for full-size renders.
+    """
+    import numpy as np
+    with open(path) as f:
+        if f.readline().strip() != 'P3':
+            raise RenderError(f"{path} is not a plain PPM file")
+        width, height = map(int, f.readline().split())
+        f.readline()
+        pixels = np.fromstring(f.read(), dtype=np.int32, sep=' ')
+    return pixels[:width * height * 3].astype(np.uint8).reshape(height, width, 3)
+
+
+def ppm_to_png(ppm_file, opacity_file):
+    """Combine the PPM image and opacity map into PNG bytes with alpha."""
+    import numpy as np
+    from PIL import Image
+    rgba = np.dstack([read_ppm(ppm_file), read_ppm(opacity_file)[:, :, 0]])
+    out = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(out, format='PNG')
+    return out.getvalue()
+
+
+def preview_image(png, width, fmt='webp'):
+    """Downscale PNG bytes to at most width pixels wide and recompress them.
+
+    WebP keeps the transparency at a fraction of the size of the PNG.
+    """
+    from PIL import Image
+    if fmt not in PREVIEW_TYPES:
+        raise RenderError(f"unknown preview format {fmt}")
+    image = Image.open(io.BytesIO(png))
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize((width, height), Image.LANCZOS)
+    out = io.BytesIO()
+    if fmt == 'webp':
+        image.save(out, format='WEBP', quality=85, method=4)
+    else:
+        image.save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+def render_cards(render_lines, output):
+    """Return the per-render cards, starting with RESET, writing to output."""
+    cards = ['reset']
+    for line in render_lines:
+        if cards[-1][:3].lower() == 'cal':
+            line = output
+        cards.append(line)
+    if output not in cards:
+        raise RenderError("command file has no calculate command")
+    return cards
+
+
+def render_cold(executable, input_text, timeout=60):
+    """Render a command file with a new ``illustrate`` process, return PNG bytes."""
+    read_block, _, render_lines = split_input(input_text)
+    with tempfile.TemporaryDirectory(prefix='illustrate_') as workdir:
+        output = os.path.join(workdir, 'render.pnm')
+        cards = read_block + render_cards(render_lines, output)
+        result = subprocess.run([os.path.abspath(executable)],
+                                input='\n'.join(cards) + '\n', cwd=workdir,
+                                capture_output=True, text=True, timeout=timeout)
+        if not os.path.exists(output):
+            log = (result.stdout + result.stderr).strip().splitlines()[-5:]
+            raise RenderError("illustrate wrote no image: " + '\n'.join(log))
+        return ppm_to_png(output, os.path.join(workdir, 'opacity.pnm'))
+
+
+def check_service(service, input_files):
+    """Compare renders on warm workers with new ``illustrate`` runs.
+
+    The files are rendered in order and then in reverse on the service, so
+    each render follows another request on the same worker when they share
+    a structure. Returns the names of the files whose images differ.
+    """
+    texts = {}
+    for name in input_files:
+        with open(name) as f:
+            texts[name] = f.read()
+    cold = {name: render_cold(service.executable, text, service.timeout)
+            for name, text in texts.items()}
+    failed = []
+    for name in list(input_files) + list(reversed(input_files)):
+        warm = service.submit(texts[name]).result()
+        same = warm == cold[name]
+        print(f"{name}: {'same' if same else 'DIFFERS from a new run'}")
+        if not same and name not in failed:
+            failed.append(name)
+    return failed
+
+
+class Worker:
+    """One ``illustrate`` process holding one parsed, classified structure."""
+
+    def __init__(self, executable, read_block, memory_limit_mb):
+        self.workdir = tempfile.mkdtemp(prefix='illustrate_')
+        self.lock = threading.Lock()
+        self.lines = queue.Queue()
+        self.renders = 0
+
+        command = [executable]
+        if memory_limit_mb:
+            # the shell sets the limit: preexec_fn is not safe while other
+            # threads are running
+            command = ['/bin/sh', '-c', f'ulimit -v {memory_limit_mb * 1024} && exec "$0"',
+                       executable]
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=self.workdir,
+            text=True,
+            bufsize=1,
+        )
+        threading.Thread(target=self._pump, daemon=True).start()
+        self._send(read_block)
+
+    def _pump(self):
+        for line in self.proc.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def _send(self, lines):
+        try:
+            self.proc.stdin.write('\n'.join(lines) + '\n')
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise RenderError(f"illustrate process exited: {e}")
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def render(self, render_lines, timeout):
+        """Run one render and return PNG bytes."""
+        output = os.path.join(self.workdir, 'render.pnm')
+        opacity = os.path.join(self.workdir, 'opacity.pnm')
+        cards = render_cards(render_lines, output)
+        # a render that writes no image must not return the last one
+        for name in (output, opacity):
+            if os.path.exists(name):
+                os.remove(name)
+
+        log = deque(maxlen=20)
+        deadline = time.monotonic() + timeout
+        self._send(cards)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.close()
+                raise RenderError(f"render timed out after {timeout} seconds")
+            try:
+                line = self.lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if line is None:
+                self.close()
+                raise RenderError("illustrate exited: " + ''.join(log).strip())
+            if END_MARKER in line:
+                break
+            log.append(line)
+        self.renders += 1
+        if not os.path.exists(output):
+            raise RenderError("illustrate wrote no image: " + ''.join(log).strip())
+        return ppm_to_png(output, opacity)
+
+    def close(self):
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class RenderService:
+    """Queues, coalesces and runs render requests on warm workers."""
+
+    def __init__(self, executable='./illustrate', max_structures=4,
+                 concurrency=2, memory_limit_mb=2048, timeout=60,
+                 result_cache_size=32, structure_dir=STRUCTURE_DIR,
+                 preview_cache_size=256, structure_limit_mb=STRUCTURE_LIMIT_MB):
+        self.executable = os.path.abspath(executable)
+        self.structure_dir = structure_dir
+        self.structure_limit_mb = structure_limit_mb
+        self.max_structures = max_structures
+        self.memory_limit_mb = memory_limit_mb
+        self.timeout = timeout
+        self.result_cache_size = result_cache_size
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.lock = threading.Lock()
+        self.workers = OrderedDict()
+        self.results = OrderedDict()
+        self.preview_cache_size = preview_cache_size
+        self.previews = OrderedDict()
+        self.inflight = {}
+        self.digests = {}
+        self.latencies = deque(maxlen=500)
+        self.counts = defaultdict(int)
+
+    def _pdb_digest(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key not in self.digests:
+            self.digests[key] = file_digest(path)
+        return self.digests[key]
+
+    def _keys(self, input_text):
+        read_block, pdb_files, render_lines = split_input(input_text)
+        # reject bad requests before a worker is started for them
+        render_cards(render_lines, 'render.pnm')
+        for pdb_file in pdb_files:
+            if not os.path.exists(pdb_file):
+                raise RenderError(f"PDB file {pdb_file} not found")
+        key = structure_key(read_block, {f: self._pdb_digest(f) for f in pdb_files})
+        request_key = hashlib.sha256(
+            (key + '\n'.join(render_lines)).encode()
+        ).hexdigest()
+        return key, read_block, render_lines, request_key
+
+    def preview(self, input_text, width, fmt='webp', timeout=None):
+        """Return a downscaled, recompressed render, cached by render hash."""
+        preview_key = (self._keys(input_text)[3], width, fmt)
+        with self.lock:
+            if preview_key in self.previews:
+                self.previews.move_to_end(preview_key)
+                self.counts['preview_cache_hits'] += 1
+                return self.previews[preview_key]
+        image = preview_image(self.submit(input_text, timeout).result(), width, fmt)
+        with self.lock:
+            self.previews[preview_key] = image
+            while len(self.previews) > self.preview_cache_size:
+                self.previews.popitem(last=False)
+        return image
+
+    def submit(self, input_text, timeout=None):
+        """Queue a render; identical requests in flight share one Future."""
+        key, read_block, render_lines, request_key = self._keys(input_text)
+        timeout = min(timeout or self.timeout, self.timeout)
+
+        with self.lock:
+            if request_key in self.results:
+                self.results.move_to_end(request_key)
+                self.counts['result_cache_hits'] += 1
+                future = Future()
+                future.set_result(self.results[request_key])
+                return future
+            if request_key in self.inflight:
+                self.counts['coalesced'] += 1
+                return self.inflight[request_key]
+            self.counts['queued'] += 1
+            future = self.pool.submit(self._run, key, read_block,
+                                      render_lines, request_key, timeout,
+                                      time.monotonic())
+            self.inflight[request_key] = future
+            return future
+
+    def _worker_for(self, structure_key, read_block):
+        with self.lock:
+            worker = self.workers.get(structure_key)
+            if worker is not None and worker.alive():
+                self.workers.move_to_end(structure_key)
+                self.counts['structure_cache_hits'] += 1
+                return worker
+            if worker is not None:
+                worker.close()
+            self.counts['structure_cache_misses'] += 1
+            if self.structure_dir:
+                cards, _ = structure_block(read_block, structure_key,
+                                           self.structure_dir,
+                                           self.structure_limit_mb)
+                if cards[0] == 'load':
+                    self.counts['structure_loads'] += 1
+            else:
+                cards = read_block
+            worker = Worker(self.executable, cards, self.memory_limit_mb)
+            self.workers[structure_key] = worker
+            while len(self.workers) > self.max_structures:
+                _, old = self.workers.popitem(last=False)
+                threading.Thread(target=self._retire, args=(old,),
+                                 daemon=True).start()
+            return worker
+
+    @staticmethod
+    def _retire(worker):
+        with worker.lock:
+            worker.close()
+
+    def _run(self, structure_key, read_block, render_lines, request_key,
+             timeout, submitted):
+        with self.lock:
+            self.counts['queued'] -= 1
+            self.counts['running'] += 1
+        try:
+            worker = self._worker_for(structure_key, read_block)
+            with worker.lock:
+                remaining = timeout - (time.monotonic() - submitted)
+                if remaining <= 0:
+                    raise RenderError(f"render timed out after {timeout} "
+                                      "seconds in the queue")
+                png = worker.render(render_lines, remaining)
+            with self.lock:
+                self.results[request_key] = png
+                while len(self.results) > self.result_cache_size:
+                    self.results.popitem(last=False)
+                self.counts['completed'] += 1
+                self.latencies.append(time.monotonic() - submitted)
+            return png
+        except Exception:
+            with self.lock:
+                self.counts['failed'] += 1
+                worker = self.workers.get(structure_key)
+                if worker is not None and not worker.alive():
+                    del self.workers[structure_key]
+            raise
+        finally:
+            with self.lock:
+                self.counts['running'] -= 1
+                self.inflight.pop(request_key, None)
+
+    def stats(self):
+        """Return queue depth, cache counters and latency percentiles."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = dict(self.counts)
+            stats['queue_depth'] = stats.pop('queued', 0)
+            stats['structures'] = len(self.workers)
+        if latencies:
+            stats['latency_p50'] = latencies[len(latencies) // 2]
+            stats['latency_p95'] = latencies[int(len(latencies) * 0.95)]
+            stats['latency_max'] = latencies[-1]
+        return stats
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            for worker in self.workers.values():
+                worker.close()
+            self.workers.clear()
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _reply(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, json.dumps(self.service.stats()).encode())
+        else:
+            self._reply(404, b'{"error": "not found"}')
+
+    def do_POST(self):
+        if self.path != '/render':
+            self._reply(404, b'{"error": "not found"}')
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            if request.get('width'):
+                fmt = request.get('format', 'webp')
+                image = self.service.preview(request['input'], int(request['width']),
+                                             fmt, request.get('timeout'))
+                content_type = PREVIEW_TYPES[fmt]
+            else:
+                future = self.service.submit(request['input'], request.get('timeout'))
+                image = future.result()
+                content_type = 'image/png'
+        except (RenderError, KeyError, ValueError, OSError) as e:
+            self._reply(500, json.dumps({'error': str(e)}).encode())
+            return
+        self._reply(200, image, content_type)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def request_render(input_text, url=DEFAULT_URL, timeout=30, width=None, fmt='webp'):
+    """Render a command file on a running render service, return PNG bytes.
+
+    With a width, return a preview at most that many pixels wide in the
+    given format instead. Raises ConnectionError if no service is listening,
+    RenderError if the service could not render the request.
+    """
+    request = {'input': input_text, 'timeout': timeout}
+    if width:
+        request.update(width=width, format=fmt)
+    body = json.dumps(request).encode()
+    request = urllib.request.Request(url + '/render', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout + 5) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get('error', str(e))
+        except ValueError:
+            message = str(e)
+        raise RenderError(message)
+    except (urllib.error.URLError, ConnectionError) as e:
+        raise ConnectionError(f"render service not available at {url}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--executable', default='./illustrate')
+    parser.add_argument('--structures', type=int, default=4,
+                        help='number of structures kept parsed in memory')
+    parser.add_argument('--concurrency', type=int, default=2,
+                        help='number of renders run at the same time')
+    parser.add_argument('--memory-limit', type=int, default=2048,
+                        help='address space limit per worker process (MB)')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='maximum time per request (seconds)')
+    parser.add_argument('--structure-dir', default=STRUCTURE_DIR,
+                        help='directory of compiled structure files '
+                             '(empty to always read the PDB files)')
+    parser.add_argument('--structure-limit', type=int, default=STRUCTURE_LIMIT_MB,
+                        help='size of the structure directory (MB); least '
+                             'recently used files are removed beyond it')
+    parser.add_argument('--check', nargs='+', metavar='INPUT',
+                        help='compare renders of these command files with new '
+                             'illustrate runs, then exit')
+    args = parser.parse_args()
+
+    if args.check:
+        service = RenderService(
+            args.executable, args.structures, 1, args.memory_limit,
+            args.timeout, result_cache_size=0, structure_dir=args.structure_dir,
+            structure_limit_mb=args.structure_limit)
+        try:
+            failed = check_service(service, args.check)
+        finally:
+            service.shutdown()
+        raise SystemExit(1 if failed else 0)
+
+    RenderRequestHandler.service = RenderService(
+        args.executable, args.structures, args.concurrency,
+        args.memory_limit, args.timeout,
+        structure_dir=args.structure_dir, structure_limit_mb=args.structure_limit)
+    server = ThreadingHTTPServer((args.host, args.port), RenderRequestHandler)
+    print(f"ILLUSTRATE render service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        RenderRequestHandler.service.shutdown()
+
+
+if __name__ == '__main__':
+    main()